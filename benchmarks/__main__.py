@@ -0,0 +1,299 @@
+import os
+import sys
+import json
+import select
+import argparse
+import platform
+import tempfile
+import subprocess
+from threading import Thread
+from time import perf_counter_ns, monotonic_ns, sleep
+from ctypes import c_int
+from contextlib import redirect_stdout
+
+from inputct import virtual
+from inputct.evdev import input_event_struct, _code_map, EV, SYN, KEY
+from inputct.uinput import UInputDevice
+from inputct.loopback import LoopbackOutput, LoopbackDevice, nodes
+from inputct.clock import CLOCK_MONOTONIC
+from inputct.stats import Histogram
+from inputct.realtime import disable as disable_realtime
+
+from .streams import STREAMS, CONFIGS, SYN_REPORT, taps
+
+# Synthetic event streams through the read, map and emit paths, reported
+# as JSON.  Pipes stand in for evdev and uinput nodes, so nothing here
+# needs devices or root.
+
+PIPE_EVENTS = 2000
+READ_EVENTS = 64
+
+
+def _chunks(frames, limit=PIPE_EVENTS):
+    chunk = []
+    n = 0
+    for frame in frames:
+        if n + len(frame) > limit:
+            yield chunk, n
+            chunk = []
+            n = 0
+        chunk.append(frame)
+        n += len(frame)
+    if chunk:
+        yield chunk, n
+
+def _result(bench, stream, events, ns, **extra):
+    return dict(bench=bench, stream=stream, events=events, seconds=ns / 1e9,
+                events_per_sec=events * 1e9 / ns, ns_per_event=ns / events, **extra)
+
+def _percentiles(h):
+    return {f'p{p:g}_us': h.percentile(p) / 1000 for p in (50, 90, 99, 99.9)} | {'max_us': h.max / 1000}
+
+
+# EventDevice.__next__, one event per read and decoded to InputEvent
+def bench_next(stream, frames):
+    total = events = 0
+    with LoopbackOutput(b'bench', ()) as out, LoopbackDevice(out.dev) as dev:
+        for chunk, n in _chunks(frames):
+            for frame in chunk:
+                out.write(frame)
+            start = perf_counter_ns()
+            for _ in range(n):
+                next(dev)
+            total += perf_counter_ns() - start
+            events += n
+    return _result('next', stream, events, total)
+
+
+# EventDevice.read in bulk, split into frames at SYN_REPORT
+def bench_read(stream, frames):
+    total = events = count = 0
+    with LoopbackOutput(b'bench', ()) as out, LoopbackDevice(out.dev) as dev:
+        source = virtual.Source(dev)
+        for chunk, n in _chunks(frames):
+            for frame in chunk:
+                out.write(frame)
+            start = perf_counter_ns()
+            left = n
+            while left:
+                batch = list(dev.read(min(left, READ_EVENTS)))
+                left -= len(batch)
+                # a read can end mid frame, its tail is not a frame yet
+                for _, _, _, chunk in virtual._frames(source, batch):
+                    if chunk[-1][2] == EV.SYN and chunk[-1][3] == SYN.REPORT:
+                        count += 1
+            total += perf_counter_ns() - start
+            events += n
+    return _result('read', stream, events, total, frames=count)
+
+
+# a source that hands out prepared reads; the pipe only gives epoll an fd
+class _Batches:
+
+    dev = 'batches'
+
+    def __init__(self, batches):
+        self.batches = iter(batches)
+        self.r, self.w = os.pipe2(os.O_CLOEXEC)
+
+    def fileno(self):
+        return self.r
+
+    def close(self):
+        os.close(self.r)
+        os.close(self.w)
+
+    def read(self, count=READ_EVENTS):
+        return input_event_struct.iter_unpack(next(self.batches))
+
+class _Watcher:
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+
+    def request(self):
+        pass
+
+class _Sink:
+
+    def __init__(self):
+        self.frames = 0
+
+    def put(self, items, stamp=None):
+        self.frames += 1
+        return True
+
+    def stats(self):
+        return {'frames': self.frames}
+
+def _config(stream):
+    with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as f:
+        f.write(CONFIGS[stream])
+    try:
+        return virtual.reload(f.name)
+    finally:
+        os.unlink(f.name)
+
+
+# the virtual keymap, modifier and combo dispatch, from raw reads to frames
+def bench_map(stream, frames):
+    pack = input_event_struct.pack
+    events = [pack(0, 0, *e) for frame in frames for e in frame]
+    batches = [b''.join(events[i:i + READ_EVENTS]) for i in range(0, len(events), READ_EVENTS)]
+    batches.append(pack(0, 0, 1, KEY.KEY_ESC, 1) + pack(0, 0, *SYN_REPORT))
+
+    sink = _Sink()
+    watcher = _Watcher(_config(stream))
+    source = _Batches(batches)
+    start = perf_counter_ns()
+    virtual.pump([virtual.Source(source)], sink, watcher)
+    total = perf_counter_ns() - start
+    source.close()
+    return _result('map', stream, len(events), total, frames=sink.frames)
+
+
+# UInputDevice.emit per event and UInputDevice.write per frame, into a pipe
+def bench_emit(stream, frames):
+    r, w = os.pipe2(os.O_CLOEXEC)
+    dev = UInputDevice.__new__(UInputDevice)
+    dev.fd = w
+    results = []
+    try:
+        coded = [[(_code_map[t](c), v) for t, c, v in frame] for frame in frames]
+        for name in ('emit', 'write'):
+            total = events = 0
+            for chunk, n in _chunks(coded if name == 'emit' else frames):
+                start = perf_counter_ns()
+                if name == 'emit':
+                    for frame in chunk:
+                        for code, value in frame:
+                            dev.emit(code, value)
+                else:
+                    for frame in chunk:
+                        dev.write(frame)
+                total += perf_counter_ns() - start
+                events += n
+                os.read(r, n * input_event_struct.size)
+            results.append(_result(name, stream, events, total))
+    finally:
+        dev.fd = None
+        os.close(r)
+        os.close(w)
+    return results
+
+
+# the whole virtual pipeline over loopback devices, paced at rate frames
+# per second; latency is from the source write to the output write.  Key
+# taps map one to one, so sent and received frames pair up in order.
+def bench_latency(frames, engine, rate, realtime=None):
+    sent = []
+    received = []
+    h = Histogram()
+    with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as f:
+        f.write(f"NAME = 'bench-out'\nEVENTS = []\n{CONFIGS['keyboard']}")
+    src = LoopbackOutput(b'bench-src', ())
+
+    def collect(dev):
+        while select.select([dev], [], [], 0.2)[0]:
+            for sec, usec, type, code, value in dev.read(READ_EVENTS):
+                if type == 0 and code == 0:
+                    received.append(sec * 1000000000 + usec * 1000)
+
+    def drive():
+        while not any(n.name == 'bench-out' for n in list(nodes.values())):
+            sleep(0.001)
+        name = next(k for k, n in list(nodes.items()) if n.name == 'bench-out')
+        dev = LoopbackDevice(name)
+        dev.open()
+        dev.set_clock_id(c_int(CLOCK_MONOTONIC))
+        reader = Thread(target=collect, args=(dev,), daemon=True)
+        reader.start()
+        period = 1000000000 // rate
+        deadline = monotonic_ns()
+        for frame in frames:
+            deadline += period
+            sleep(max(deadline - monotonic_ns(), 0) / 1e9)
+            sent.append(monotonic_ns())
+            src.write(frame)
+        reader.join()
+        src.write([(1, KEY.KEY_ESC, 1), SYN_REPORT])
+        dev.close()
+
+    driver = Thread(target=drive)
+    driver.start()
+    try:
+        with redirect_stdout(sys.stderr):
+            virtual.main(f.name, [src.dev], engine, loopback=True, realtime=realtime)
+    finally:
+        driver.join()
+        if realtime is not None:
+            disable_realtime()
+        src.close()
+        os.unlink(f.name)
+
+    for t0, t1 in zip(sent, received):
+        h.record(t1 - t0)
+    return dict(bench='latency', stream='taps', engine=engine, rate=rate, realtime=realtime is not None,
+                sent=len(sent), received=len(received), **_percentiles(h))
+
+
+BENCHES = ('next', 'read', 'map', 'emit', 'latency')
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--frames', type=int, default=20000, help='frames per stream')
+    parser.add_argument('--latency-frames', type=int, default=2000)
+    parser.add_argument('--rate', type=int, default=1000, help='frames per second for latency runs')
+    parser.add_argument('--bench', action='append', choices=BENCHES)
+    parser.add_argument('--stream', action='append', choices=tuple(STREAMS))
+    parser.add_argument('--realtime', type=int, nargs='?', const=50, metavar='PRIORITY',
+                        help='repeat latency runs with virtual --realtime')
+    parser.add_argument('--load', type=int, default=0, metavar='N',
+                        help='busy processes competing for the cpu during latency runs')
+    parser.add_argument('-o', '--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    results = []
+    for stream in args.stream or STREAMS:
+        frames = STREAMS[stream](args.frames)
+        for bench in args.bench or BENCHES:
+            done = len(results)
+            if bench == 'next':
+                results.append(bench_next(stream, frames))
+            elif bench == 'read':
+                results.append(bench_read(stream, frames))
+            elif bench == 'map':
+                results.append(bench_map(stream, frames))
+            elif bench == 'emit':
+                results.extend(bench_emit(stream, frames))
+            elif bench == 'latency' and stream == 'keyboard':
+                load = [subprocess.Popen([sys.executable, '-c', 'while True: pass']) for _ in range(args.load)]
+                try:
+                    for realtime in (None, args.realtime) if args.realtime is not None else (None,):
+                        for engine in ('thread', 'epoll'):
+                            results.append(bench_latency(taps(args.latency_frames), engine, args.rate, realtime))
+                            results[-1]['load'] = args.load
+                finally:
+                    for p in load:
+                        p.kill()
+                        p.wait()
+            for result in results[done:]:
+                print(json.dumps(result), file=sys.stderr)
+
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
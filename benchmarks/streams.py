@@ -0,0 +1,85 @@
+from inputct.evdev import rawcode, KEY, REL, ABS, MSC, SYN
+
+SYN_REPORT = rawcode(SYN.REPORT) + (0,)
+
+_keys = [rawcode(k) for k in (KEY.KEY_H, KEY.KEY_E, KEY.KEY_L, KEY.KEY_O, KEY.KEY_SPACE, KEY.KEY_W, KEY.KEY_R, KEY.KEY_D)]
+_scan = rawcode(MSC.SCAN)
+
+
+# typing: every press and release is MSC_SCAN, KEY and SYN_REPORT, with a
+# held shift around every fourth key
+def keyboard(frames):
+    shift = rawcode(KEY.KEY_LEFTSHIFT)
+    out = []
+    i = 0
+    while len(out) < frames:
+        key = _keys[i % len(_keys)]
+        if i % 4 == 0:
+            out.append([(*_scan, 0x700e1), (*shift, 1), SYN_REPORT])
+        for value in (1, 0):
+            out.append([(*_scan, 0x70000 + key[1]), (*key, value), SYN_REPORT])
+        if i % 4 == 0:
+            out.append([(*_scan, 0x700e1), (*shift, 0), SYN_REPORT])
+        i += 1
+    return out[:frames]
+
+
+# one key tapped over and over, one press or release per frame
+def taps(frames):
+    key = rawcode(KEY.KEY_E)
+    return [[(*_scan, 0x70008), (*key, (i & 1) ^ 1), SYN_REPORT] for i in range(frames)]
+
+
+# an 8 kHz mouse: REL_X/REL_Y every frame, a click every 1000 frames
+def mouse(frames):
+    x, y = rawcode(REL.X), rawcode(REL.Y)
+    left = rawcode(KEY.BTN_LEFT)
+    out = []
+    for i in range(frames):
+        frame = [(*x, (i % 7) - 3), (*y, (i % 5) - 2)]
+        if i % 1000 == 0:
+            frame.append((*left, (i // 1000) & 1 ^ 1))
+        frame.append(SYN_REPORT)
+        out.append(frame)
+    return out
+
+
+# two fingers moving on a touchpad, type B protocol with the single touch
+# emulation the kernel adds
+def multitouch(frames):
+    slot, tid = rawcode(ABS.MT_SLOT), rawcode(ABS.MT_TRACKING_ID)
+    mx, my = rawcode(ABS.MT_POSITION_X), rawcode(ABS.MT_POSITION_Y)
+    ax, ay = rawcode(ABS.X), rawcode(ABS.Y)
+    touch = rawcode(KEY.BTN_TOUCH)
+    out = [[(*slot, 0), (*tid, 1), (*slot, 1), (*tid, 2), (*touch, 1), SYN_REPORT]]
+    for i in range(1, frames):
+        p = i % 1000
+        out.append([(*slot, 0), (*mx, 100 + p), (*my, 200 + p),
+                    (*slot, 1), (*mx, 900 - p), (*my, 200 + p),
+                    (*ax, 100 + p), (*ay, 200 + p), SYN_REPORT])
+    return out
+
+
+STREAMS = {
+    'keyboard': keyboard,
+    'mouse': mouse,
+    'multitouch': multitouch,
+}
+
+
+# virtual configs exercising the keymap, modifiers and combos per stream
+CONFIGS = {
+    'keyboard': """
+MODIFIERS = [KEY_LEFTSHIFT]
+KEYMAP = {KEY_E: KEY_E, KEY_L: KEY_L, KEY_O: KEY_O, KEY_SPACE: KEY_SPACE, KEY_R: KEY_R, KEY_D: KEY_D}
+COMBO = {(KEY_LEFTSHIFT,): {KEY_H: [(KEY_J, 1), (KEY_J, 0)]}}
+""",
+    'mouse': """
+KEYMAP = {REL.X: REL.X, REL.Y: REL.Y, BTN_LEFT: BTN_RIGHT}
+""",
+    'multitouch': """
+KEYMAP = {ABS.MT_SLOT: ABS.MT_SLOT, ABS.MT_TRACKING_ID: ABS.MT_TRACKING_ID,
+          ABS.MT_POSITION_X: ABS.MT_POSITION_X, ABS.MT_POSITION_Y: ABS.MT_POSITION_Y,
+          ABS.X: ABS.X, ABS.Y: ABS.Y, BTN_TOUCH: BTN_TOUCH}
+""",
+}
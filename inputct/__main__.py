@@ -1,10 +1,23 @@
 import argparse
 
+def cpu_list(s):
+    return {int(c) for c in s.split(',')}
+
+def seconds(s):
+    value = float(s)
+    if not 0 < value < float('inf'):
+        raise argparse.ArgumentTypeError(f"not a positive number of seconds: {s!r}")
+    return value
+
 parser = argparse.ArgumentParser()
 subparsers = parser.add_subparsers(help='sub-command help', dest='COMMAND')
 
 parser_list = subparsers.add_parser('list', help='list devices')
 parser_list.add_argument('-v', '--verbose', action='store_true')
+parser_list.add_argument('--json', action='store_true', help='one JSON array instead of text')
+parser_list.add_argument('--has', action='append', default=[], metavar='CODE',
+                         help='only devices with this capability, e.g. KEY_A, EV.ABS, INPUT_PROP.DIRECT')
+parser_list.add_argument('-j', '--jobs', type=int, default=1, help='threads reading sysfs')
 
 parser_show = subparsers.add_parser('show', help='show device info')
 parser_show.add_argument('-v', '--verbose', action='store_true')
@@ -14,20 +27,113 @@ parser_monitor = subparsers.add_parser('monitor', help='monitor device event')
 parser_monitor.add_argument('device')
 
 parser_virtual = subparsers.add_parser('virtual', help='run a virtual device')
+parser_virtual.add_argument('--engine', choices=('thread', 'epoll'), default='thread',
+                            help='reader and emitter threads, or a single epoll loop')
+parser_virtual.add_argument('--stats', action='store_true',
+                            help='print frame latency percentiles every --stats-interval and on exit')
+parser_virtual.add_argument('--stats-interval', type=seconds, default=10.0, metavar='SECONDS',
+                            help='how often --stats prints, defaults to 10')
+parser_virtual.add_argument('--profile', action='store_true',
+                            help='sample CPU time per pipeline stage, printed on SIGUSR1 and on exit')
+parser_virtual.add_argument('--offload', action='store_true',
+                            help='program configs with only key to key remaps into the kernel keymap')
+parser_virtual.add_argument('--control', metavar='SOCKET',
+                            help='serve reload, pause, resume, stats and state on a unix socket')
+parser_virtual.add_argument('--state', metavar='DIR',
+                            help='publish the held keys and axes of each source in DIR/<device>.state')
 parser_virtual.add_argument('config')
-parser_virtual.add_argument('device')
+parser_virtual.add_argument('device', nargs='*', help='source devices, defaults to SOURCES from config')
+
+parser_supervise = subparsers.add_parser('supervise', help='run a virtual device per config in a directory')
+parser_supervise.add_argument('--engine', choices=('thread', 'epoll'), default='thread')
+parser_supervise.add_argument('--cpus', type=cpu_list,
+                              help='comma separated cpus to pin workers to, defaults to all allowed')
+parser_supervise.add_argument('--interval', type=float, default=10, metavar='SECONDS',
+                              help='print aggregated worker stats every SECONDS, 0 for only on SIGUSR1')
+parser_supervise.add_argument('directory')
+
+parser_analyze = subparsers.add_parser('analyze', help='statistics of a captured event stream')
+parser_analyze.add_argument('--chatter', type=float, default=10, metavar='MS',
+                            help='count presses this soon after a release of the same key as chatter')
+parser_analyze.add_argument('--start', type=float, metavar='SECONDS', help='skip this far into the capture')
+parser_analyze.add_argument('--end', type=float, metavar='SECONDS', help='stop this far into the capture')
+parser_analyze.add_argument('capture')
+
+parser_record = subparsers.add_parser('record', help='record device events to a capture file')
+parser_record.add_argument('--codec', choices=('zlib', 'lzma', 'none'), default='zlib')
+parser_record.add_argument('--chunk', type=int, default=65536, metavar='EVENTS', help='events per compressed chunk')
+parser_record.add_argument('--grab', action='store_true', help='keep the events from everyone else while recording')
+parser_record.add_argument('device')
+parser_record.add_argument('capture')
+
+parser_replay = subparsers.add_parser('replay', help='replay a recorded capture through uinput')
+parser_replay.add_argument('--start', type=float, metavar='SECONDS', help='start this far into the capture')
+parser_replay.add_argument('--end', type=float, metavar='SECONDS', help='stop this far into the capture')
+parser_replay.add_argument('--speed', type=float, default=1.0, help='playback speed, 0 for as fast as possible')
+parser_replay.add_argument('capture')
+
+for p in (parser_virtual, parser_replay):
+    p.add_argument('--realtime', action='store_true', help='realtime scheduling, locked memory and no cyclic GC')
+    p.add_argument('--priority', type=int, default=50, help='realtime scheduling priority')
+    p.add_argument('--policy', choices=('fifo', 'rr'), default='fifo', help='realtime scheduling policy')
+    p.add_argument('--cpus', type=cpu_list, help='comma separated cpus to run on')
+
+parser_bridge = subparsers.add_parser('bridge', help='mirror a device on another host')
+bridge_commands = parser_bridge.add_subparsers(dest='BRIDGE', required=True)
+parser_send = bridge_commands.add_parser('send', help='stream the frames of a device')
+parser_send.add_argument('--grab', action='store_true', help='keep the events from local readers')
+parser_send.add_argument('device')
+parser_recv = bridge_commands.add_parser('recv', help='mirror a streamed device through uinput')
+parser_recv.add_argument('address', help='HOST:PORT to listen on')
+parser_recv.add_argument('name', nargs='?', help='name of the mirror, defaults to the name of the source')
+for p in (parser_send, parser_recv):
+    p.add_argument('--udp', action='store_true', help='datagrams with periodic key state resync instead of TCP')
+    p.add_argument('--resync', type=float, default=0.25, metavar='SECONDS',
+                   help='how often key state is resent over UDP')
+parser_send.add_argument('address', help='HOST:PORT of the receiver')
+
+parser_state = subparsers.add_parser('state', help='show a device state block published by virtual --state')
+parser_state.add_argument('file')
+
+parser_ctl = subparsers.add_parser('ctl', help='control a running virtual device')
+parser_ctl.add_argument('socket')
+parser_ctl.add_argument('command', choices=('reload', 'pause', 'resume', 'stats', 'state'))
 
 args = parser.parse_args()
 if args.COMMAND == 'list':
-    from .evdev import list_devices
+    import sys
+    from .evdev import scan, lookup, EV
 
-    for device in list_devices():
-        print(device.dev, device.phys, device.name, end="")
-        print(' '.join(repr(p) for p in device.properties))
-        if args.verbose:
-            for key, caps in device.capabilities.items():
-                print(f"  {key.__name__}: ", end="")
-                print(' '.join(repr(cap) for cap in caps))
+    codes = [lookup(name) for name in args.has]
+    devices = [info for info in scan(args.jobs) if all(info.has(code) for code in codes)]
+
+    def names(codes):
+        return sorted(codes, key=int)
+
+    if args.json:
+        import json
+
+        def label(code):
+            return getattr(code, 'name', code)
+
+        result = []
+        for info in devices:
+            entry = dict(dev=info.dev, name=info.name, phys=info.phys,
+                         properties=[label(p) for p in names(info.decode_properties())])
+            if args.verbose:
+                entry['capabilities'] = {m.__name__: [label(c) for c in names(codes)]
+                                         for m, codes in info.decode_capabilities().items()}
+            else:
+                entry['capabilities'] = [m.__name__ for m in info.masks if m is not EV]
+            result.append(entry)
+        sys.stdout.write(json.dumps(result) + "\n")
+    else:
+        lines = []
+        for info in devices:
+            lines.append(' '.join([info.dev, info.phys, info.name, *map(repr, names(info.decode_properties()))]))
+            for m, codes in (info.decode_capabilities() if args.verbose else {}).items():
+                lines.append(f"  {m.__name__}: " + ' '.join(map(repr, names(codes))))
+        sys.stdout.write(''.join(line + "\n" for line in lines))
 
 elif args.COMMAND == 'show':
     from .evdev import EventDevice, EV, ABS
@@ -77,7 +183,86 @@ elif args.COMMAND == 'monitor':
 
 elif args.COMMAND == 'virtual':
     from .virtual import main
-    main(args.config, args.device)
+    main(args.config, args.device, args.engine, args.stats_interval if args.stats else None, args.control,
+         profile=args.profile, realtime=args.priority if args.realtime else None, policy=args.policy,
+         cpus=args.cpus, offload=args.offload, state=args.state)
+
+elif args.COMMAND == 'supervise':
+    from .supervise import main
+    main(args.directory, args.engine, args.cpus, args.interval)
+
+elif args.COMMAND == 'analyze':
+    from .analyze import analyze, to_events
+    from .capture import Capture
+    import json
+    capture = Capture(args.capture)
+    events = to_events(capture.read(capture.offset(args.start), capture.offset(args.end)))
+    print(json.dumps(analyze(events, args.chatter), indent=2))
+
+elif args.COMMAND == 'record':
+    from .evdev import EventDevice, input_event_struct, grab
+    from .capture import CaptureWriter, describe
+    from contextlib import nullcontext
+    import os
+
+    with EventDevice(args.device) as device, \
+         CaptureWriter(args.capture, describe(device), args.codec, args.chunk) as capture, \
+         grab(device) if args.grab else nullcontext():
+        try:
+            while True:
+                capture.write(os.read(device.fileno(), 1024 * input_event_struct.size))
+        except KeyboardInterrupt:
+            pass
+
+elif args.COMMAND == 'replay':
+    from .capture import Capture, replay, output_args
+    from .uinput import UInputDevice
+
+    capture = Capture(args.capture)
+    if capture.description is None:
+        parser.error("plain captures do not describe their device, record one with `inputct record`")
+    with UInputDevice(*output_args(capture.description)) as output:
+        if args.realtime:
+            from .realtime import enable
+            for step, e in enable(args.priority, args.policy, args.cpus):
+                print("realtime:", step, "failed:", e)
+        try:
+            replay(capture, output, capture.offset(args.start), capture.offset(args.end), args.speed)
+        except KeyboardInterrupt:
+            pass
+
+elif args.COMMAND == 'bridge':
+    from .bridge import Sender, Receiver, address
+    from .evdev import EventDevice, grab
+    from contextlib import nullcontext
+
+    try:
+        if args.BRIDGE == 'send':
+            with EventDevice(args.device) as device, \
+                 grab(device) if args.grab else nullcontext(), \
+                 Sender(device, address(args.address), args.udp, args.resync) as sender:
+                sender.run()
+        else:
+            with Receiver(address(args.address), args.name, args.udp, args.resync) as receiver:
+                receiver.run()
+    except KeyboardInterrupt:
+        pass
+
+elif args.COMMAND == 'state':
+    from .shared import SharedState
+    from .analyze import label
+    from .evdev import EV, _bits
+    import json
+
+    with SharedState(args.file) as state:
+        frames, time, keys, axes = state.snapshot()
+    print(json.dumps(dict(frames=frames, time=time / 1e6, held=[label(EV.KEY, code) for code in _bits(keys)],
+                          axes={label(EV.ABS, code): value for code, value in enumerate(axes) if value}), indent=2))
+
+elif args.COMMAND == 'ctl':
+    from .control import request
+    import json
+    print(json.dumps(request(args.socket, args.command), indent=2))
 
 else:
     parser.print_help()
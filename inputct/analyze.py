@@ -0,0 +1,167 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .evdev import input_event_struct, EV, _code_map
+from .capture import Capture
+
+# Statistics of a capture, see capture.py.  Plain captures are mapped, not
+# read, recorded ones decompressed only for the chunks in range.  With
+# NumPy the records are viewed as a structured array and every statistic
+# is a handful of whole-array operations, without it the records are
+# unpacked one by one.
+
+CHATTER_MS = 10
+
+if numpy is not None:
+    EVENT = numpy.dtype([('sec', 'l'), ('usec', 'l'), ('type', 'H'), ('code', 'H'), ('value', 'i')])
+    assert EVENT.itemsize == input_event_struct.size
+
+
+def label(type, code):
+    m = _code_map.get(type, None)
+    member = m._value2member_map_.get(code, None) if m is not None else None
+    if member is None:
+        return f"{type}.{code}"
+    return f"{m.__name__}.{member.name}"
+
+
+def _rank(ordered, q):
+    return int(ordered[min(len(ordered) - 1, int(q * len(ordered)))])
+
+
+def _polling(intervals):
+    result = dict(frames=len(intervals) + 1 if len(intervals) else 0)
+    if len(intervals):
+        p50 = _rank(intervals, 0.5)
+        result['rate_hz'] = round(1e6 / p50, 1) if p50 else None
+        result['interval_us'] = {name: _rank(intervals, q)
+                                 for name, q in (('min', 0), ('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1))}
+    return result
+
+
+# Records read from a capture as a structured array with NumPy, as they
+# are without.  For a plain capture both are views of the mapping.
+def to_events(data):
+    if numpy is not None:
+        return numpy.frombuffer(data, EVENT, len(data) // input_event_struct.size)
+    return data
+
+
+def load(path, start=None, end=None):
+    return to_events(Capture(path).read(start, end))
+
+
+def analyze(events, chatter_ms=CHATTER_MS):
+    if numpy is not None and isinstance(events, numpy.ndarray):
+        return _analyze_array(events, chatter_ms)
+    return _analyze_records(input_event_struct.iter_unpack(events), chatter_ms)
+
+
+def _analyze_array(events, chatter_ms):
+    result = dict(events=len(events))
+    if not len(events):
+        return result
+    type = events['type']
+    code = events['code']
+    value = events['value']
+    time = events['sec'] * 1000000 + events['usec']
+    result['duration_s'] = (int(time[-1]) - int(time[0])) / 1e6
+
+    keys, counts = numpy.unique((type.astype(numpy.uint32) << 16) | code, return_counts=True)
+    result['counts'] = {label(int(k) >> 16, int(k) & 0xffff): int(n) for k, n in zip(keys, counts)}
+
+    syn = (type == EV.SYN) & (code == 0)
+    result['polling'] = _polling(numpy.sort(numpy.diff(time[syn])))
+
+    # a press of a key following its own release closer than chatter_ms
+    keys = (type == EV.KEY) & (value < 2)
+    order = numpy.argsort(code[keys], kind='stable')
+    c = code[keys][order]
+    v = value[keys][order]
+    t = time[keys][order]
+    bounce = (c[1:] == c[:-1]) & (v[:-1] == 0) & (v[1:] == 1) & (t[1:] - t[:-1] < chatter_ms * 1000)
+    presses = dict(zip(*numpy.unique(c[v == 1], return_counts=True)))
+    result['chatter'] = {label(EV.KEY, int(k)): dict(presses=int(presses[k]), chatter=int(n))
+                         for k, n in zip(*numpy.unique(c[1:][bounce], return_counts=True))}
+
+    # absolute axes, noise being the median change between updates
+    axes = type == EV.ABS
+    order = numpy.argsort(code[axes], kind='stable')
+    c = code[axes][order]
+    v = value[axes][order]
+    result['axes'] = {}
+    if len(c):
+        starts = numpy.flatnonzero(numpy.r_[True, c[1:] != c[:-1]])
+        same = c[1:] == c[:-1]
+        delta = numpy.abs(numpy.diff(v.astype(numpy.int64)))[same]
+        dc = c[1:][same]
+        order = numpy.lexsort((delta, dc))
+        delta = delta[order]
+        dc, dstarts, dcounts = numpy.unique(dc[order], return_index=True, return_counts=True)
+        noise = dict(zip(dc, delta[dstarts + dcounts // 2]))
+        for k, lo, hi, n in zip(c[starts], numpy.minimum.reduceat(v, starts),
+                                numpy.maximum.reduceat(v, starts), numpy.diff(numpy.r_[starts, len(c)])):
+            result['axes'][label(EV.ABS, int(k))] = dict(min=int(lo), max=int(hi), updates=int(n),
+                                                         noise=int(noise.get(k, 0)))
+    return result
+
+
+def _analyze_records(records, chatter_ms):
+    chatter_us = chatter_ms * 1000
+    n = 0
+    first = last = None
+    counts = {}
+    intervals = []
+    frame = None
+    released = {}
+    presses = {}
+    bounces = {}
+    axes = {}
+    for sec, usec, type, code, value in records:
+        n += 1
+        last = sec * 1000000 + usec
+        if first is None:
+            first = last
+        key = (type, code)
+        counts[key] = counts.get(key, 0) + 1
+        if type == EV.SYN:
+            if code == 0:
+                if frame is not None:
+                    intervals.append(last - frame)
+                frame = last
+        elif type == EV.KEY:
+            if value == 1:
+                presses[code] = presses.get(code, 0) + 1
+                at = released.pop(code, None)
+                if at is not None and last - at < chatter_us:
+                    bounces[code] = bounces.get(code, 0) + 1
+            elif value == 0:
+                released[code] = last
+        elif type == EV.ABS:
+            axis = axes.get(code, None)
+            if axis is None:
+                axes[code] = [value, value, 1, value, []]
+            else:
+                axis[0] = min(axis[0], value)
+                axis[1] = max(axis[1], value)
+                axis[2] += 1
+                axis[4].append(abs(value - axis[3]))
+                axis[3] = value
+
+    result = dict(events=n)
+    if not n:
+        return result
+    result['duration_s'] = (last - first) / 1e6
+    result['counts'] = {label(*key): counts[key] for key in sorted(counts)}
+    intervals.sort()
+    result['polling'] = _polling(intervals)
+    result['chatter'] = {label(EV.KEY, k): dict(presses=presses[k], chatter=bounces[k]) for k in sorted(bounces)}
+    result['axes'] = {}
+    for k in sorted(axes):
+        lo, hi, updates, _, deltas = axes[k]
+        deltas.sort()
+        result['axes'][label(EV.ABS, k)] = dict(min=lo, max=hi, updates=updates,
+                                                noise=deltas[len(deltas) // 2] if deltas else 0)
+    return result
@@ -0,0 +1,48 @@
+from .evdev import input_absinfo
+
+LUT_BITS = 16
+
+_range = range
+
+
+# Compiles an ABS axis transform into a lookup table.  The source range
+# [info.minimum, info.maximum] is quantised to at most 2**LUT_BITS steps;
+# the table maps (value - minimum) >> shift to the output value.
+#
+#   calibrate  measured (low, center, high) of the raw axis
+#   deadzone   fraction of each half around center that reads as center
+#   curve      response exponent, 1 is linear
+#   invert     flip the axis
+#   range      (minimum, maximum) of the output axis
+def compile_axis(info, calibrate=None, deadzone=0, curve=1, invert=False, range=None):
+    lo, hi = info.minimum, info.maximum
+    low, center, high = calibrate or (lo, (lo + hi) / 2, hi)
+    out_lo, out_hi = range or (lo, hi)
+
+    def transform(v):
+        if v < center:
+            x = max((v - center) / (center - low), -1.0) if center > low else -1.0
+        else:
+            x = min((v - center) / (high - center), 1.0) if high > center else 1.0
+        m = abs(x)
+        if m <= deadzone:
+            x = 0
+        else:
+            m = ((m - deadzone) / (1 - deadzone)) ** curve
+            x = -m if (x < 0) != bool(invert) else m
+        return round(out_lo + (x + 1) * (out_hi - out_lo) / 2)
+
+    shift = 0
+    while (hi - lo) >> shift >= 1 << LUT_BITS:
+        shift += 1
+    lut = [transform(lo + (k << shift)) for k in _range(((hi - lo) >> shift) + 1)]
+
+    ratio = (out_hi - out_lo) / (hi - lo) if hi > lo else 1
+    out = input_absinfo()
+    out.value = transform(min(max(info.value, lo), hi))
+    out.minimum = out_lo
+    out.maximum = out_hi
+    out.fuzz = round(info.fuzz * ratio)
+    out.flat = 0 if deadzone else round(info.flat * ratio)
+    out.resolution = round(info.resolution * ratio)
+    return lut, lo, hi, shift, out
@@ -0,0 +1,280 @@
+import os
+import json
+import random
+import select
+import socket
+import struct
+from time import monotonic_ns
+
+from .clock import Timer
+from .evdev import EV, SYN, input_event_struct, _bits
+from .capture import describe, output_args
+from .uinput import UInputDevice
+
+# Streams the frames of a source device to a uinput mirror on another
+# host.  Every packet is a header and a payload:
+#
+#   kind:u8 session:u32 seq:u32 length:u32 payload
+#
+# FRAMES carries whole SYN-delimited frames as type:u16 code:u16 value:i32
+# records, as many as one read of the device returned.  DESCRIBE carries
+# the device description the mirror is created from (see capture.py),
+# STATE the codes of all held keys as u16s.  Over TCP the description and
+# key state go out once on connect and TCP_NODELAY keeps batches from
+# waiting on acks.  Over UDP a packet is a datagram, description and key
+# state are repeated every `resync` seconds, and the receiver drops late
+# packets, counts gaps in seq as lost and brings its held keys in line with
+# every STATE, so a lost release leaves a key stuck no longer than that.
+
+FRAMES = 0
+DESCRIBE = 1
+STATE = 2
+
+RESYNC = 0.25
+READ_EVENTS = 1024
+
+header_struct = struct.Struct("<BIII")
+record_struct = struct.Struct("<HHi")
+code_struct = struct.Struct("<H")
+
+
+def address(s):
+    host, _, port = s.rpartition(':')
+    return host.strip('[]') or '0.0.0.0', int(port)
+
+def _family(addr):
+    return socket.AF_INET6 if ':' in addr[0] else socket.AF_INET
+
+
+class Sender:
+
+    def __init__(self, device, addr, udp=False, resync=RESYNC):
+        self.device = device
+        self.udp = udp
+        self.resync = int(resync * 1000000000)
+        self.sock = socket.socket(_family(addr), socket.SOCK_DGRAM if udp else socket.SOCK_STREAM)
+        if not udp:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.connect(addr)
+        self.session = random.getrandbits(32)
+        self.seq = 0
+        self.description = json.dumps(describe(device)).encode()
+        self.held = int.from_bytes(device.get_key(), 'little')
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, exc, tb):
+        self.close()
+
+    def packet(self, kind, payload):
+        self.sock.sendall(header_struct.pack(kind, self.session, self.seq, len(payload)) + payload)
+        self.seq = (self.seq + 1) & 0xffffffff
+
+    def sync(self):
+        self.packet(DESCRIBE, self.description)
+        self.packet(STATE, b''.join(code_struct.pack(code) for code in _bits(self.held)))
+
+    def run(self):
+        poll = select.epoll()
+        poll.register(self.device, select.EPOLLIN)
+        timer = Timer()
+        if self.udp:
+            poll.register(timer, select.EPOLLIN)
+            timer.set(monotonic_ns() + self.resync, self.resync)
+        pack = record_struct.pack
+        pending = bytearray()
+        dropped = False
+        try:
+            self.sync()
+            while True:
+                for fd, _ in poll.poll():
+                    if fd == timer.fileno():
+                        timer.read()
+                        self.sync()
+                        continue
+                    data = os.read(fd, READ_EVENTS * input_event_struct.size)
+                    if not data:
+                        return
+                    out = bytearray()
+                    for _, _, type, code, value in input_event_struct.iter_unpack(data):
+                        if type == EV.SYN:
+                            if code == SYN.DROPPED:
+                                # the rest of this frame is gone, as in
+                                # libevdev resync from the device state
+                                dropped = True
+                                pending.clear()
+                                continue
+                            if code == SYN.REPORT:
+                                if dropped:
+                                    dropped = False
+                                    if out:
+                                        self.packet(FRAMES, out)
+                                        out = bytearray()
+                                    self.held = int.from_bytes(self.device.get_key(), 'little')
+                                    self.sync()
+                                else:
+                                    out += pending
+                                    out += pack(type, code, value)
+                                pending.clear()
+                                continue
+                        if dropped:
+                            continue
+                        if type == EV.KEY:
+                            if value:
+                                self.held |= 1 << code
+                            else:
+                                self.held &= ~(1 << code)
+                        pending += pack(type, code, value)
+                    if out:
+                        self.packet(FRAMES, out)
+        finally:
+            timer.close()
+            poll.close()
+
+
+# The held keys of an output, so a STATE can be applied as the difference
+class Mirror:
+
+    def __init__(self, output):
+        self.output = output
+        self.held = set()
+
+    def close(self):
+        self.sync(())
+        self.output.close()
+
+    def write(self, events):
+        held = self.held
+        for type, code, value in events:
+            if type == EV.KEY:
+                if value:
+                    held.add(code)
+                else:
+                    held.discard(code)
+        self.output.write(events)
+
+    def sync(self, keys):
+        keys = set(keys)
+        frame = [(EV.KEY, code, 0) for code in sorted(self.held - keys)]
+        frame += [(EV.KEY, code, 1) for code in sorted(keys - self.held)]
+        self.held = keys
+        if frame:
+            frame.append((EV.SYN, SYN.REPORT, 0))
+            self.output.write(frame)
+
+
+class Receiver:
+
+    def __init__(self, addr, name=None, udp=False, resync=RESYNC, output_device=UInputDevice):
+        self.name = name.encode() if isinstance(name, str) else name
+        self.udp = udp
+        self.resync = resync
+        self.output_device = output_device
+        self.sock = socket.socket(_family(addr), socket.SOCK_DGRAM if udp else socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(addr)
+        if not udp:
+            self.sock.listen()
+        self.mirror = None
+        self.session = None
+        self.seq = None
+        self.packets = 0
+        self.lost = 0
+        self.late = 0
+
+    @property
+    def address(self):
+        return self.sock.getsockname()
+
+    def close(self):
+        self._detach()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, exc, tb):
+        self.close()
+
+    def _detach(self):
+        if self.mirror is not None:
+            self.mirror.close()
+            self.mirror = None
+
+    def handle(self, kind, session, seq, payload):
+        self.packets += 1
+        if session != self.session:
+            # a new sender, its device may be a different one
+            self._detach()
+            self.session = session
+            self.seq = None
+        elif self.seq is not None:
+            gap = (seq - self.seq) & 0xffffffff
+            if gap == 0 or gap >= 0x80000000:
+                self.late += 1
+                return
+            self.lost += gap - 1
+        self.seq = seq
+
+        if kind == DESCRIBE:
+            if self.mirror is None:
+                name, events, props, abs = output_args(json.loads(payload))
+                self.mirror = Mirror(self.output_device(self.name or name, events, props, abs))
+        elif self.mirror is None:
+            return
+        elif kind == FRAMES:
+            self.mirror.write(list(record_struct.iter_unpack(payload)))
+        elif kind == STATE:
+            self.mirror.sync(code for code, in code_struct.iter_unpack(payload))
+
+    def run(self):
+        if self.udp:
+            self._run_udp()
+        else:
+            while True:
+                conn, _ = self.sock.accept()
+                with conn:
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    self._serve(conn)
+                self._detach()
+                self.session = None
+
+    def _serve(self, conn):
+        buf = bytearray()
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                return
+            buf += data
+            offset = 0
+            while len(buf) - offset >= header_struct.size:
+                kind, session, seq, length = header_struct.unpack_from(buf, offset)
+                end = offset + header_struct.size + length
+                if end > len(buf):
+                    break
+                self.handle(kind, session, seq, bytes(buf[offset+header_struct.size:end]))
+                offset = end
+            del buf[:offset]
+
+    def _run_udp(self):
+        # a sender that went quiet for a few resyncs is gone, so are its keys
+        self.sock.settimeout(self.resync * 4)
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                if self.mirror is not None:
+                    self.mirror.sync(())
+                continue
+            if len(data) < header_struct.size:
+                continue
+            kind, session, seq, length = header_struct.unpack_from(data)
+            self.handle(kind, session, seq, data[header_struct.size:header_struct.size+length])
@@ -0,0 +1,235 @@
+import os
+import json
+import mmap
+import zlib
+import lzma
+import struct
+from bisect import bisect_left
+from time import monotonic_ns, sleep
+
+from .evdev import input_event_struct, input_absinfo, EV, SYN, KEY, REL, ABS, MSC, SW, LED, SND, INPUT_PROP, _code_map, _type_map
+
+# Capture files.  A plain capture is the raw struct input_event stream of
+# a device.  Recorded captures are split into chunks of up to `chunk`
+# events, each compressed on its own and preceded by a small header with
+# its size and time range, followed by an index of all chunks and a
+# trailer pointing at it:
+#
+#   MAGIC codec:u8 length:u32 description:json
+#   (size:u32 events:u32 first:i64 last:i64 data)*
+#   (offset:u64 size:u32 events:u32 first:i64 last:i64)*
+#   index:u64 chunks:u32 MAGIC
+#
+# Times are event timestamps in microseconds.  Seeking is a bisection over
+# the index and then over the records of one decompressed chunk.  A file
+# whose recording was cut short has no trailer, its index is rebuilt from
+# the chunk headers.
+
+MAGIC = b"INPUTCT\x01"
+CODECS = {'none': 0, 'zlib': 1, 'lzma': 2}
+CHUNK_EVENTS = 65536
+REPLAYED = (KEY, REL, ABS, MSC, SW, LED, SND)
+
+header_struct = struct.Struct("<8sBI")
+chunk_struct = struct.Struct("<IIqq")
+index_struct = struct.Struct("<QIIqq")
+trailer_struct = struct.Struct("<QI8s")
+time_struct = struct.Struct("ll")
+
+_compress = {0: bytes, 1: zlib.compress, 2: lzma.compress}
+_decompress = {1: zlib.decompress, 2: lzma.decompress}
+
+
+def _time(data, i):
+    sec, usec = time_struct.unpack_from(data, i * input_event_struct.size)
+    return sec * 1000000 + usec
+
+# first record at or after `time`
+def _bisect(data, time):
+    lo, hi = 0, len(data) // input_event_struct.size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _time(data, mid) < time:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+# Name, properties, capabilities and absinfo of an open EventDevice, enough
+# to create a uinput device like it for replay
+def describe(device):
+    caps = device.capabilities
+    return dict(
+        name=device.name,
+        properties=sorted(int(p) for p in device.properties),
+        events=sorted((int(_type_map[m]), int(code)) for m, codes in caps.items() if m is not EV for code in codes),
+        abs={int(code): _absinfo(device.get_abs(code)) for code in caps.get(ABS, ())})
+
+def _absinfo(info):
+    return [info.value, info.minimum, info.maximum, info.fuzz, info.flat, info.resolution]
+
+# UInputDevice arguments for a description, leaving out codes the enums or
+# uinput do not know
+def output_args(description):
+    events = []
+    for type, code in description['events']:
+        m = _code_map.get(type, None)
+        if m in REPLAYED and code in m._value2member_map_:
+            events.append(m(code))
+    props = [INPUT_PROP(p) for p in description['properties'] if p in INPUT_PROP._value2member_map_]
+    abs = [(ABS(int(code)), input_absinfo(*info)) for code, info in description['abs'].items()
+           if int(code) in ABS._value2member_map_]
+    return description['name'].encode(), events, props, abs
+
+
+# Writes the frames between two times to `output`, spaced as they were
+# recorded divided by `speed`, or back to back for speed 0
+def replay(capture, output, start=None, end=None, speed=1.0):
+    frame = []
+    base = None
+    for block in capture.events(start, end):
+        for sec, usec, type, code, value in input_event_struct.iter_unpack(block):
+            frame.append((type, code, value))
+            if type != EV.SYN or code != SYN.REPORT:
+                continue
+            if speed:
+                time = sec * 1000000 + usec
+                if base is None:
+                    base = monotonic_ns() - time * 1000 / speed
+                delay = base + time * 1000 / speed - monotonic_ns()
+                if delay > 0:
+                    sleep(delay / 1e9)
+            output.write(frame)
+            frame = []
+
+
+class CaptureWriter:
+
+    def __init__(self, path, description=None, codec='zlib', chunk=CHUNK_EVENTS):
+        self.file = open(path, 'wb')
+        self.codec = CODECS[codec]
+        self.chunk = chunk * input_event_struct.size
+        self.buf = bytearray()
+        self.index = []
+        meta = json.dumps(description or {}).encode()
+        self.file.write(header_struct.pack(MAGIC, self.codec, len(meta)) + meta)
+
+    def write(self, data):
+        self.buf += data
+        while len(self.buf) >= self.chunk:
+            self._flush(self.chunk)
+
+    def _flush(self, size):
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
+        events = len(data) // input_event_struct.size
+        first, last = _time(data, 0), _time(data, events - 1)
+        packed = _compress[self.codec](data)
+        self.index.append((self.file.tell(), len(packed), events, first, last))
+        self.file.write(chunk_struct.pack(len(packed), events, first, last))
+        self.file.write(packed)
+
+    def close(self):
+        if self.file is not None:
+            size = len(self.buf) - len(self.buf) % input_event_struct.size
+            if size:
+                self._flush(size)
+            offset = self.file.tell()
+            self.file.write(b''.join(index_struct.pack(*entry) for entry in self.index))
+            self.file.write(trailer_struct.pack(offset, len(self.index), MAGIC))
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, exc, tb):
+        self.close()
+
+
+# Read side of both kinds of capture.  events() yields the records between
+# two times as bytes-like blocks, one decompressed chunk at a time, so
+# replay streams and only the chunks in range are ever decompressed.  The
+# blocks of a plain capture are slices of the mapping itself.
+class Capture:
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self.mm = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) if size else b''
+        if self.mm[:len(MAGIC)] != MAGIC:
+            self.codec = None
+            self.description = None
+            size -= size % input_event_struct.size
+            events = size // input_event_struct.size
+            self.index = [(0, size, events, _time(self.mm, 0), _time(self.mm, events - 1))] if events else []
+        else:
+            _, self.codec, length = header_struct.unpack_from(self.mm)
+            start = header_struct.size + length
+            self.description = json.loads(self.mm[header_struct.size:start])
+            self.index = self._read_index(start)
+        self.firsts = [entry[3] for entry in self.index]
+        self.lasts = [entry[4] for entry in self.index]
+
+    def _read_index(self, start):
+        mm = self.mm
+        if len(mm) >= start + trailer_struct.size:
+            offset, chunks, magic = trailer_struct.unpack_from(mm, len(mm) - trailer_struct.size)
+            if magic == MAGIC:
+                return [index_struct.unpack_from(mm, offset + i * index_struct.size) for i in range(chunks)]
+        index = []
+        offset = start
+        while offset + chunk_struct.size <= len(mm):
+            size, events, first, last = chunk_struct.unpack_from(mm, offset)
+            # a partly written chunk, or the start of a partly written index
+            if offset + chunk_struct.size + size > len(mm) or not events or first > last:
+                break
+            index.append((offset, size, events, first, last))
+            offset += chunk_struct.size + size
+        return index
+
+    @property
+    def first(self):
+        return self.firsts[0] if self.index else None
+
+    @property
+    def last(self):
+        return self.lasts[-1] if self.index else None
+
+    # event time `seconds` into the capture
+    def offset(self, seconds):
+        if seconds is None or not self.index:
+            return None
+        return self.first + int(seconds * 1000000)
+
+    def __len__(self):
+        return sum(entry[2] for entry in self.index)
+
+    def chunk(self, i):
+        offset, size, _, _, _ = self.index[i]
+        if self.codec is not None:
+            offset += chunk_struct.size
+        if not self.codec:
+            return memoryview(self.mm)[offset:offset+size]
+        return _decompress[self.codec](self.mm[offset:offset+size])
+
+    def events(self, start=None, end=None):
+        i = 0 if start is None else bisect_left(self.lasts, start)
+        for i in range(i, len(self.index)):
+            if end is not None and self.firsts[i] >= end:
+                break
+            data = self.chunk(i)
+            lo = _bisect(data, start) if start is not None and self.firsts[i] < start else 0
+            hi = _bisect(data, end) if end is not None and self.lasts[i] >= end else len(data) // input_event_struct.size
+            if lo == 0 and hi * input_event_struct.size == len(data):
+                yield data
+            else:
+                yield data[lo*input_event_struct.size:hi*input_event_struct.size]
+
+    # all records in range as one block, without a copy where possible
+    def read(self, start=None, end=None):
+        blocks = list(self.events(start, end))
+        if len(blocks) == 1:
+            return blocks[0]
+        return b''.join(blocks)
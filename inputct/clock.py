@@ -0,0 +1,66 @@
+import os
+from ctypes import Structure, POINTER, c_int, c_long
+
+from .libc import libc, check
+
+CLOCK_MONOTONIC = 1
+TFD_TIMER_ABSTIME = 1
+
+class timespec(Structure):
+    _fields_ = [('sec', c_long),
+                ('nsec', c_long)]
+
+class itimerspec(Structure):
+    _fields_ = [('interval', timespec),
+                ('value', timespec)]
+
+libc.timerfd_create.argtypes = [c_int, c_int]
+libc.timerfd_settime.argtypes = [c_int, c_int, POINTER(itimerspec), POINTER(itimerspec)]
+
+
+# one-shot or periodic timerfd on CLOCK_MONOTONIC, armed with absolute
+# deadlines in time.monotonic_ns() units
+class Timer:
+
+    def __init__(self):
+        self.fd = check(libc.timerfd_create(CLOCK_MONOTONIC, os.O_NONBLOCK | os.O_CLOEXEC))
+        self._spec = itimerspec()
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd is not None:
+            fd = self.fd
+            self.fd = None
+            os.close(fd)
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, exc, tb):
+        self.close()
+
+    def set(self, deadline, interval=0):
+        spec = self._spec
+        deadline = max(deadline, 1)
+        spec.value.sec = deadline // 1000000000
+        spec.value.nsec = deadline % 1000000000
+        spec.interval.sec = interval // 1000000000
+        spec.interval.nsec = interval % 1000000000
+        check(libc.timerfd_settime(self.fd, TFD_TIMER_ABSTIME, spec, None))
+
+    def cancel(self):
+        spec = self._spec
+        spec.value.sec = spec.value.nsec = 0
+        spec.interval.sec = spec.interval.nsec = 0
+        check(libc.timerfd_settime(self.fd, TFD_TIMER_ABSTIME, spec, None))
+
+    def read(self):
+        try:
+            return int.from_bytes(os.read(self.fd, 8), 'little')
+        except BlockingIOError:
+            return 0
@@ -0,0 +1,115 @@
+import os
+import json
+import select
+import socket
+from traceback import print_exc
+
+
+# Line based control socket.  Each line is a command and its arguments
+# separated by spaces, answered with one line of JSON.  Clients are served
+# from the caller's event loop: fileno() is an epoll set covering the
+# listening socket and all connections, handle() services whatever is ready
+# without blocking.
+class Server:
+
+    def __init__(self, path, handler):
+        self.path = path
+        self.handler = handler
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC)
+        self.sock.bind(path)
+        self.sock.listen()
+        self.poll = select.epoll()
+        self.poll.register(self.sock, select.EPOLLIN)
+        self.clients = {}
+
+    def fileno(self):
+        return self.poll.fileno()
+
+    def close(self):
+        if self.sock is not None:
+            for conn, _ in self.clients.values():
+                conn.close()
+            self.clients.clear()
+            self.poll.close()
+            self.sock.close()
+            self.sock = None
+            os.unlink(self.path)
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, exc, tb):
+        self.close()
+
+    def handle(self):
+        for fd, _ in self.poll.poll(0):
+            if fd == self.sock.fileno():
+                self._accept()
+            else:
+                self._serve(fd)
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except BlockingIOError:
+                return
+            conn.setblocking(False)
+            self.clients[conn.fileno()] = (conn, bytearray())
+            self.poll.register(conn, select.EPOLLIN)
+
+    def _drop(self, fd):
+        conn, _ = self.clients.pop(fd)
+        self.poll.unregister(fd)
+        conn.close()
+
+    def _serve(self, fd):
+        conn, buf = self.clients[fd]
+        try:
+            data = conn.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(fd)
+            return
+
+        buf += data
+        while b'\n' in buf:
+            line, _, rest = buf.partition(b'\n')
+            buf[:] = rest
+            try:
+                conn.sendall(self._call(line.decode().split()) + b'\n')
+            except OSError:
+                self._drop(fd)
+                return
+
+    # the reply to one command, encoded, and an error reply whatever fails
+    def _call(self, args):
+        if not args:
+            return json.dumps({"error": "empty command"}).encode()
+        try:
+            return json.dumps(self.handler(*args)).encode()
+        except Exception as e:
+            print_exc()
+            return json.dumps({"error": f"{type(e).__name__}: {e}"}).encode()
+
+
+def request(path, *args, timeout=None):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM | socket.SOCK_CLOEXEC) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(' '.join(args).encode() + b'\n')
+        buf = b''
+        while not buf.endswith(b'\n'):
+            data = sock.recv(65536)
+            if not data:
+                break
+            buf += data
+    return json.loads(buf)
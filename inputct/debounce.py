@@ -0,0 +1,129 @@
+import select
+from array import array
+from collections import deque
+from time import monotonic_ns
+
+from .clock import Timer
+from .evdev import EV, SYN, _bits
+
+KEY_CNT = 0x300
+
+MODES = ('eager', 'deferred')
+
+
+# Filters key chatter out of a source device, in front of everything else.
+# The first transition of a key that has been quiet for `window` ms always
+# passes at once.  In eager mode the key then ignores changes for `window`
+# ms; a change it ignored is looked at again `window` ms later and the key
+# takes on whatever state it settled in.  In deferred mode presses pass at
+# once but a release is held back until the key stayed up for `window` ms,
+# and a press within that time takes the release back.  Per key state
+# lives in preallocated arrays indexed by code, times are event timestamps
+# in us.  With one window for all keys, deadlines come due in the order
+# they were queued, so settling never scans.  fileno() is an epoll set of
+# the device and the settling timer, read() returns whatever either
+# produced.
+class Debouncer:
+
+    def __init__(self, dev, window, mode='eager'):
+        assert mode in MODES, f"DEBOUNCE_MODE must be one of {MODES}"
+        self.dev = dev
+        self.window = int(window * 1000)
+        self.deferred = mode == 'deferred'
+        self.last = array('q', bytes(KEY_CNT * 8))
+        self.due = array('q', bytes(KEY_CNT * 8))
+        self.raw = bytearray(KEY_CNT)
+        self.emitted = bytearray(KEY_CNT)
+        self.queue = deque()
+        self.suppressed = 0
+        self.timer = Timer()
+        self.poll = select.epoll()
+        self.poll.register(dev, select.EPOLLIN)
+        self.poll.register(self.timer, select.EPOLLIN)
+        self._resync()
+
+    def __getattr__(self, name):
+        return getattr(self.dev, name)
+
+    def fileno(self):
+        return self.poll.fileno()
+
+    def close(self):
+        if self.timer is not None:
+            self.poll.close()
+            self.timer.close()
+            self.timer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, exc, tb):
+        self.close()
+
+    # keys already down when the filter starts count as settled
+    def _resync(self):
+        for code in _bits(int.from_bytes(self.dev.get_key(), 'little')):
+            if code < KEY_CNT:
+                self.raw[code] = self.emitted[code] = 1
+
+    def read(self, count=64):
+        out = []
+        for fd, _ in self.poll.poll():
+            if fd == self.timer.fileno():
+                self.timer.read()
+                self._settle(out)
+            else:
+                self._filter(self.dev.read(count), out)
+        return out
+
+    def _filter(self, events, out):
+        last = self.last
+        due = self.due
+        raw = self.raw
+        emitted = self.emitted
+        window = self.window
+        for event in events:
+            sec, usec, type, code, value = event
+            if type != EV.KEY or code >= KEY_CNT:
+                out.append(event)
+                continue
+            if value == 2:
+                if emitted[code]:
+                    out.append(event)
+                continue
+            raw[code] = value
+            if value == emitted[code]:
+                self.suppressed += 1
+                continue
+            now = sec * 1000000 + usec
+            if value if self.deferred else now - last[code] >= window:
+                emitted[code] = value
+                last[code] = now
+                out.append(event)
+                continue
+            self.suppressed += 1
+            # a deferred release starts over, an eager key settles once
+            if self.deferred or not due[code]:
+                at = due[code] = now + window
+                deadline = monotonic_ns() + window * 1000
+                if not self.queue:
+                    self.timer.set(deadline)
+                self.queue.append((deadline, code, at))
+
+    def _settle(self, out):
+        queue = self.queue
+        now = monotonic_ns()
+        while queue and queue[0][0] <= now:
+            _, code, at = queue.popleft()
+            if self.due[code] != at:
+                continue
+            self.due[code] = 0
+            value = self.raw[code]
+            if value != self.emitted[code]:
+                self.emitted[code] = value
+                self.last[code] = at
+                sec, usec = divmod(at, 1000000)
+                out.append((sec, usec, EV.KEY, code, value))
+                out.append((sec, usec, EV.SYN, SYN.REPORT, 0))
+        if queue:
+            self.timer.set(queue[0][0])
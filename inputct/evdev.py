@@ -1,4 +1,5 @@
 import os
+import struct
 from functools import cached_property, reduce, wraps
 from enum import IntEnum
 from ctypes import (
@@ -11,12 +12,15 @@ from datetime import datetime, timedelta
 from fcntl import ioctl
 from errno import errorcode
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 try:
     from inspect import get_annotations
 except ImportError:
     def get_annotations(o):
         return o.__annotations__
 
+SYSFS = "/sys/class/input"
+
 class INPUT_PROP(IntEnum):
     POINTER        = 0x00
     DIRECT         = 0x01
@@ -830,6 +834,9 @@ class input_event(Structure):
         ("value", c_int32),
     ]
 
+input_event_struct = struct.Struct("llHHi")
+assert input_event_struct.size == sizeof(input_event)
+
 class input_id(Structure):
     _fields_ = [
         ("bustype", c_uint16),
@@ -857,6 +864,8 @@ class input_keymap_entry(Structure):
         ("scancode", c_uint8 * 32),
     ]
 
+INPUT_KEYMAP_BY_INDEX = 1
+
 class input_mask(Structure):
     _fields_ = [
         ("type", c_uint32),
@@ -971,23 +980,44 @@ _code_map = {
     EV.FF_STATUS: FF_STATUS,
 }
 
-def _resolve(name, caps):
-    caps = reduce(lambda acc, c: (acc<<64)|int(c,16), caps.split(" "), 0)
+_type_map = {m: ev for ev, m in _code_map.items()}
 
-    if name == 'ev':
-        m = EV
-    else:
-        m = _code_map[EV[name.upper()]]
-
-    codes = set()
-    offset = 0
-    while caps:
-        if caps & 1:
-            codes.add(m(offset))
-        offset += 1
-        caps >>= 1
+def rawcode(code):
+    return int(_type_map[type(code)]), int(code)
+
+def _bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+# sysfs bitmaps are space separated hex longs, most significant first
+def _mask(words):
+    if not words:
+        return 0
+    return reduce(lambda acc, c: (acc<<64)|int(c,16), words.split(" "), 0)
+
+def _decode(m, mask):
+    members = m._value2member_map_
+    return frozenset(members.get(bit, bit) for bit in _bits(mask))
+
+def _capability_type(name):
+    return EV if name == 'ev' else _code_map[EV[name.upper()]]
+
+def _resolve(name, caps):
+    m = _capability_type(name)
+    codes = _decode(m, _mask(caps))
     if codes:
-        return m, frozenset(codes)
+        return m, codes
+
+# KEY_A, BTN_LEFT or TYPE.NAME as in EV.ABS, ABS.MT_SLOT, INPUT_PROP.DIRECT
+def lookup(name):
+    if '.' not in name:
+        return KEY[name]
+    m, _, name = name.partition('.')
+    return _lookup_types[m][name]
+
+_lookup_types = {m.__name__: m for m in (EV, INPUT_PROP, *_code_map.values())}
 
 _IOC_NONE = 0
 _IOC_WRITE = 1
@@ -1049,7 +1079,7 @@ class EventDevice:
         self.mode = 0
 
     def _readfile(self, name):
-        with open(f"/sys/class/input/{self.dev}/device/{name}") as f:
+        with open(f"{SYSFS}/{self.dev}/device/{name}") as f:
             return f.read().strip()
 
     @cached_property
@@ -1062,24 +1092,14 @@ class EventDevice:
 
     @cached_property
     def properties(self):
-        props =  int(self._readfile("properties"))
-
-        values = set()
-        offset = 0
-        while props:
-            if props & 1:
-                values.add(INPUT_PROP(offset))
-            offset += 1
-            props >>= 1
-
-        return frozenset(values)
+        return _decode(INPUT_PROP, int(self._readfile("properties")))
 
     @property
     def capabilities(self):
         return dict(
             filter(None,
                    (_resolve(name, self._readfile(f"capabilities/{name}"))
-                   for name in os.listdir(f"/sys/class/input/{self.dev}/device/capabilities"))))
+                   for name in os.listdir(f"{SYSFS}/{self.dev}/device/capabilities"))))
 
     def fileno(self):
         return self.fd
@@ -1113,6 +1133,10 @@ class EventDevice:
             datetime.fromtimestamp(event.time.sec) + timedelta(microseconds=event.time.usec),
             EV(event.type), event.code if m is None else m(event.code), event.value)
 
+    def read(self, count=64):
+        data = os.read(self.fd, count * input_event_struct.size)
+        return input_event_struct.iter_unpack(data)
+
 
     @_IO(0x01)
     def get_version(self) -> c_int:
@@ -1138,9 +1162,11 @@ class EventDevice:
     def set_keycode(self, arg: c_uint*2):
         return
 
-    @_IO(0x04)
-    def get_keycode_v2(self) -> input_keymap_entry:
-        return
+    # the kernel looks the entry up by its index or scancode, so unlike the
+    # other getters this one takes the request in and fills it
+    def get_keycode_v2(self, arg):
+        assert ioctl(self.fd, 0x80284504, arg) == 0
+        return arg
 
     @_IO(0x04)
     def set_keycode_v2(self, arg: input_keymap_entry):
@@ -1240,6 +1266,67 @@ def list_devices():
             for name in os.listdir("/dev/input")
             if name.startswith('event')]
 
+# What `list` shows about one device, gathered with one read per sysfs
+# attribute.  Capabilities stay bitmasks keyed by code type (EV for the
+# event types themselves), so has() is a shift and decode_*() only build
+# enum sets for callers that print them.
+@dataclass
+class DeviceInfo:
+    dev: str
+    name: str
+    phys: str
+    properties: int
+    masks: dict
+
+    def has(self, code):
+        m = type(code)
+        mask = self.properties if m is INPUT_PROP else self.masks.get(m, 0)
+        return mask >> code & 1
+
+    def decode_properties(self):
+        return _decode(INPUT_PROP, self.properties)
+
+    def decode_capabilities(self):
+        return {m: _decode(m, mask) for m, mask in self.masks.items()}
+
+
+_capability_files = ('ev', 'key', 'rel', 'abs', 'msc', 'sw', 'led', 'snd', 'ff')
+
+def _read_attribute(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        return os.read(fd, 4096).decode(errors='replace').strip()
+    finally:
+        os.close(fd)
+
+def device_info(dev):
+    base = f"{SYSFS}/{dev}/device/"
+    name = _read_attribute(base + "name")
+    if name is None:
+        # unplugged while scanning
+        return None
+    masks = {}
+    for cap in _capability_files:
+        mask = _mask(_read_attribute(f"{base}capabilities/{cap}"))
+        if mask:
+            masks[_capability_type(cap)] = mask
+    return DeviceInfo(dev, name, _read_attribute(base + "phys") or "",
+                      int(_read_attribute(base + "properties") or 0), masks)
+
+# All event devices in sysfs order, optionally read by `jobs` threads
+def scan(jobs=1):
+    devs = sorted((dev for dev in os.listdir(SYSFS) if dev.startswith('event')),
+                  key=lambda dev: int(dev[5:]))
+    if jobs > 1:
+        with ThreadPoolExecutor(jobs) as pool:
+            infos = list(pool.map(device_info, devs))
+    else:
+        infos = map(device_info, devs)
+    return [info for info in infos if info is not None]
+
 @contextmanager
 def grab(device):
     device.grab(1)
@@ -0,0 +1,52 @@
+import os
+import struct
+from ctypes import c_int, c_char_p, c_uint32
+
+from .libc import libc, check
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_DELETE      = 0x00000200
+
+libc.inotify_init1.argtypes = [c_int]
+libc.inotify_add_watch.argtypes = [c_int, c_char_p, c_uint32]
+
+_event = struct.Struct("iIII")
+
+
+class Inotify:
+
+    def __init__(self):
+        self.fd = check(libc.inotify_init1(os.O_CLOEXEC))
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd is not None:
+            fd = self.fd
+            self.fd = None
+            os.close(fd)
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, exc, tb):
+        self.close()
+
+    def add_watch(self, path, mask):
+        return check(libc.inotify_add_watch(self.fd, os.fsencode(path), mask))
+
+    def read(self):
+        data = os.read(self.fd, 4096)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _event.unpack_from(data, offset)
+            offset += _event.size
+            name = data[offset:offset+length].rstrip(b'\0')
+            offset += length
+            yield wd, mask, cookie, os.fsdecode(name)
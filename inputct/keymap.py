@@ -0,0 +1,40 @@
+from .evdev import input_keymap_entry, INPUT_KEYMAP_BY_INDEX
+
+
+# The scancode to keycode table of a source device, read once by index.
+# apply() rewrites the keycodes of all scancodes that originally produced
+# a remapped key, restore() puts the original table back.  Only entries
+# that actually change are written.
+class Keymap:
+
+    def __init__(self, dev):
+        self.dev = dev
+        self.entries = []
+        while True:
+            entry = input_keymap_entry()
+            entry.flags = INPUT_KEYMAP_BY_INDEX
+            entry.index = len(self.entries)
+            try:
+                dev.get_keycode_v2(entry)
+            except OSError:
+                break
+            entry.flags = INPUT_KEYMAP_BY_INDEX
+            self.entries.append(entry)
+        self.original = [entry.keycode for entry in self.entries]
+        self.keycodes = frozenset(self.original)
+
+    def apply(self, mapping):
+        for entry, keycode in zip(self.entries, self.original):
+            keycode = mapping.get(keycode, keycode)
+            if entry.keycode != keycode:
+                entry.keycode = keycode
+                self.dev.set_keycode_v2(entry)
+
+    def restore(self):
+        self.apply({})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, exc, tb):
+        self.restore()
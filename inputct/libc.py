@@ -0,0 +1,12 @@
+import os
+from ctypes.util import find_library
+from ctypes import CDLL, get_errno
+
+libc = CDLL(find_library('c'), use_errno=True)
+
+
+def check(result):
+    if result < 0:
+        errno = get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return result
@@ -0,0 +1,191 @@
+import os
+import errno
+from time import time_ns, monotonic_ns
+from itertools import count
+from ctypes import c_uint
+
+from .evdev import EventDevice, input_id, input_absinfo, input_event_struct, rawcode, BUS, EV, SYN
+from .clock import CLOCK_MONOTONIC
+
+# In-process stand-ins for /dev/uinput and /dev/input, so the virtual
+# pipeline runs without devices or root.  A LoopbackOutput registers a node
+# named loopN; a LoopbackDevice opened on that name gets its own pipe that
+# receives every frame written to the output, stamped like the kernel
+# would.  As with evdev, a reader that falls behind loses events and sees
+# SYN_DROPPED, and a grab diverts events to the grabbing reader only.
+
+nodes = {}
+_ids = count()
+
+SYN_DROPPED = input_event_struct.pack(0, 0, EV.SYN, SYN.DROPPED, 0)
+
+
+class Node:
+
+    def __init__(self, name, events, props, abs):
+        self.name = name
+        self.props = frozenset(props)
+        self.absinfo = {code: input_absinfo.from_buffer_copy(info) for code, info in abs}
+
+        caps = {}
+        for e in (*events, *self.absinfo):
+            caps.setdefault(type(e), set()).add(e)
+        caps[EV] = {EV(rawcode(min(codes))[0]) for codes in caps.values()} | {EV.SYN}
+        self.capabilities = {m: frozenset(codes) for m, codes in caps.items()}
+
+        self.rep = [250, 33]
+        self.keys = 0
+        self.readers = []
+        self.grabbed = None
+
+    def write(self, events):
+        keys = self.keys
+        absinfo = self.absinfo
+        for type, code, value in events:
+            if type == EV.KEY:
+                keys = keys | (1 << code) if value else keys & ~(1 << code)
+            elif type == EV.ABS:
+                info = absinfo.get(code, None)
+                if info is not None:
+                    info.value = value
+        self.keys = keys
+
+        readers = self.readers if self.grabbed is None else (self.grabbed,)
+        stamped = {}
+        pack = input_event_struct.pack
+        for reader in readers:
+            data = stamped.get(reader.clock, None)
+            if data is None:
+                ns = monotonic_ns() if reader.clock == CLOCK_MONOTONIC else time_ns()
+                sec, usec = ns // 1000000000, ns % 1000000000 // 1000
+                data = stamped[reader.clock] = b''.join([pack(sec, usec, type, code, value) for type, code, value in events])
+            reader._deliver(data)
+
+
+class LoopbackDevice(EventDevice):
+
+    def __init__(self, dev, mode=0):
+        super().__init__(dev, mode)
+        self.node = nodes[dev]
+        self.clock = 0
+        self.overflow = False
+        self._w = None
+
+    @property
+    def name(self):
+        return self.node.name
+
+    @property
+    def phys(self):
+        return f"loopback/{self.dev}"
+
+    @property
+    def properties(self):
+        return self.node.props
+
+    @property
+    def capabilities(self):
+        return self.node.capabilities
+
+    def open(self):
+        self.fd, self._w = os.pipe2(os.O_CLOEXEC | self.mode)
+        os.set_blocking(self._w, False)
+        self.node.readers.append(self)
+
+    def close(self):
+        if self.fd is not None:
+            if self.node.grabbed is self:
+                self.node.grabbed = None
+            self.node.readers.remove(self)
+            os.close(self._w)
+        super().close()
+
+    def _deliver(self, data):
+        if self.overflow:
+            data = SYN_DROPPED + data
+        try:
+            os.write(self._w, data)
+            self.overflow = False
+        except BlockingIOError:
+            self.overflow = True
+
+    def grab(self, arg):
+        arg = getattr(arg, 'value', arg)
+        if arg:
+            if self.node.grabbed not in (None, self):
+                raise OSError(errno.EBUSY, os.strerror(errno.EBUSY))
+            self.node.grabbed = self
+        else:
+            if self.node.grabbed is not self:
+                raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+            self.node.grabbed = None
+
+    def set_clock_id(self, arg):
+        self.clock = getattr(arg, 'value', arg)
+
+    def get_version(self):
+        return 0x10001
+
+    def get_id(self):
+        return input_id(bustype=BUS.VIRTUAL)
+
+    def get_name(self):
+        return self.node.name.encode() + b'\0'
+
+    def get_phys(self):
+        return self.phys.encode() + b'\0'
+
+    def get_prop(self):
+        return bytes([sum(1 << p for p in self.node.props)])
+
+    def get_key(self):
+        return self.node.keys.to_bytes(96, 'little')[:93]
+
+    def get_rep(self):
+        return (c_uint * 2)(*self.node.rep)
+
+    def set_rep(self, arg):
+        self.node.rep = list(arg)
+
+    def get_abs(self, abs):
+        return input_absinfo.from_buffer_copy(self.node.absinfo[abs])
+
+    def set_abs(self, abs, arg):
+        self.node.absinfo[abs] = arg
+
+
+# same interface as UInputDevice, registers a node instead of a device
+class LoopbackOutput:
+
+    def __init__(self, name, events, props=(), abs=()):
+        # uinput_setup.name only takes bytes, so must this
+        if not isinstance(name, bytes):
+            raise TypeError(f"expected bytes, {type(name).__name__} found")
+        name = name.decode()
+        self.dev = f"loop{next(_ids)}"
+        self.node = nodes[self.dev] = Node(name, events, props, abs)
+
+    def close(self):
+        if self.node is not None:
+            del nodes[self.dev]
+            self.node = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, exc, tb):
+        self.close()
+
+    @property
+    def sysname(self):
+        return self.dev.encode()
+
+    def emit(self, code, value):
+        self.node.write([(*rawcode(code), value)])
+
+    def write(self, events):
+        self.node.write(events)
+
+
+def list_devices():
+    return [LoopbackDevice(name) for name in nodes]
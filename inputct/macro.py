@@ -0,0 +1,142 @@
+import os
+import select
+from heapq import heappush, heappop
+from collections import deque
+from threading import Thread
+from time import monotonic_ns
+
+from .clock import Timer
+from .evdev import rawcode
+
+
+# A macro is a sequence of (offset, events) steps, where offset is the
+# absolute time in ns since the macro was started and events are raw
+# (type, code, value) tuples.
+class Macro(tuple):
+    __slots__ = ()
+
+
+def compile_macro(items):
+    steps = []
+    events = []
+    offset = 0
+    for c in items:
+        if isinstance(c, int):
+            if events:
+                steps.append((offset, tuple(events)))
+                events = []
+            offset += c
+        else:
+            code, value = c
+            events.append((*rawcode(code), value))
+    if events:
+        steps.append((offset, tuple(events)))
+    return Macro(steps)
+
+
+# Runs any number of macros at once, each step on an absolute deadline.
+# Either on a thread of its own (spawn) or driven by the caller's event
+# loop, which must call timeout() when self.timer becomes readable.
+class MacroScheduler:
+
+    def __init__(self, output):
+        self.output = output
+        self.timer = Timer()
+        self.wakeup = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        self.incoming = deque()
+        self.queue = []
+        self.seq = 0
+        self.thread = None
+        self.stopping = False
+
+        self.started = 0
+        self.steps = 0
+        self.late_total = 0
+        self.late_max = 0
+
+    def stats(self):
+        return {
+            'macros': self.started,
+            'steps': self.steps,
+            'late_mean_us': self.late_total / self.steps / 1000 if self.steps else 0,
+            'late_max_us': self.late_max / 1000,
+        }
+
+    def start(self, macro):
+        if self.thread is not None:
+            self.incoming.append((monotonic_ns(), macro))
+            os.eventfd_write(self.wakeup, 1)
+        else:
+            self._add(monotonic_ns(), macro)
+            self._arm()
+
+    def _add(self, start, macro):
+        if macro:
+            self.started += 1
+            self._push(start, macro, 0)
+
+    def _arm(self):
+        deadline = self._fire()
+        if deadline is not None:
+            self.timer.set(deadline)
+
+    def timeout(self):
+        self.timer.read()
+        self._arm()
+
+    def _push(self, start, macro, index):
+        self.seq += 1
+        heappush(self.queue, (start + macro[index][0], self.seq, start, macro, index))
+
+    def _fire(self):
+        queue = self.queue
+        write = self.output.write
+        while queue:
+            deadline, _, start, macro, index = queue[0]
+            now = monotonic_ns()
+            if deadline > now:
+                return deadline
+            heappop(queue)
+            write(macro[index][1])
+
+            late = now - deadline
+            self.steps += 1
+            self.late_total += late
+            if late > self.late_max:
+                self.late_max = late
+
+            index += 1
+            if index < len(macro):
+                self._push(start, macro, index)
+
+    def run(self):
+        poll = select.epoll()
+        poll.register(self.timer, select.EPOLLIN)
+        poll.register(self.wakeup, select.EPOLLIN)
+        incoming = self.incoming
+
+        while True:
+            poll.poll()
+            self.timer.read()
+            try:
+                os.eventfd_read(self.wakeup)
+            except BlockingIOError:
+                pass
+
+            while incoming:
+                self._add(*incoming.popleft())
+            self._arm()
+            if self.stopping and not self.queue:
+                return
+
+    def spawn(self):
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    # the thread ends once the macros already started are done
+    def stop(self):
+        if self.thread is not None:
+            self.stopping = True
+            os.eventfd_write(self.wakeup, 1)
+            self.thread.join()
@@ -0,0 +1,52 @@
+import gc
+import os
+from ctypes import c_int
+
+from .libc import libc, check
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+libc.mlockall.argtypes = [c_int]
+libc.munlockall.argtypes = []
+
+POLICIES = {
+    'fifo': os.SCHED_FIFO,
+    'rr': os.SCHED_RR,
+}
+
+
+# Puts the calling thread, and every thread it starts afterwards, on a
+# realtime policy and optionally a set of cpus, locks all current and
+# future memory so the hot loop never page faults, and freezes everything
+# allocated so far out of the cyclic GC before turning it off.  Call once
+# the config is loaded and before any thread is started.  Steps the
+# process is not allowed to take are returned as (step, error) pairs.
+def enable(priority, policy='fifo', cpus=None):
+    failed = []
+    try:
+        os.sched_setscheduler(0, POLICIES[policy], os.sched_param(priority))
+    except OSError as e:
+        failed.append(('sched_setscheduler', e))
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError as e:
+            failed.append(('sched_setaffinity', e))
+    try:
+        check(libc.mlockall(MCL_CURRENT | MCL_FUTURE))
+    except OSError as e:
+        failed.append(('mlockall', e))
+
+    gc.collect()
+    gc.freeze()
+    gc.disable()
+    return failed
+
+
+# back to the defaults, for callers that go on with other work
+def disable():
+    os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+    check(libc.munlockall())
+    gc.unfreeze()
+    gc.enable()
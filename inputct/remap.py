@@ -0,0 +1,383 @@
+from functools import reduce
+from time import monotonic_ns
+
+from .evdev import rawcode, EV, SYN, KEY, ABS
+from .macro import compile_macro
+from .clock import Timer
+from .axis import compile_axis
+
+# dispatch table actions, indexed by index(type, code).  Kinds from HOLDMAP
+# on are handled by Machine, everything before stays on the fast path.
+MAP, AXIS, SYNC, MOD, COMBO, QUIT, RELOAD, HOLDMAP, LAYER, TAPHOLD, ONESHOT, CHORD = range(12)
+
+TABLE_SIZE = 0x20 << 10
+
+def index(type, code):
+    return (type << 10) | code
+
+SYN_REPORT = (int(EV.SYN), int(SYN.REPORT), 0)
+
+# events for output n carry n in the high byte of their type
+OUTPUT_SHIFT = 8
+
+
+class Config:
+
+    def __init__(self, path, g):
+        self.name = g.get('NAME', path)
+        self.events = g.get('EVENTS', ())
+        self.props = g.get('PROPS', ())
+        self.sources = g.get('SOURCES', ())
+        self.keymap = g['KEYMAP']
+        self.axes = g.get('AXES', {})
+        self.absinfo = None
+
+        self.outputs = [(self.name, self.events, self.props)]
+        self.output_index = {}
+        for name, o in g.get('OUTPUTS', {}).items():
+            self.output_index[name] = len(self.outputs)
+            self.outputs.append((o.get('NAME', name), o.get('EVENTS', ()), o.get('PROPS', ())))
+        assert len(self.outputs) <= 0x100, "too many outputs"
+
+        self.modifiers = list(g.get('MODIFIERS', ()))
+        modifiers = {k: (1<<i) for i, k in enumerate(self.modifiers)}
+        combo = {reduce(lambda acc, m: (acc|modifiers[m]), k, 0):
+                 {code: compile_macro(macro) for code, macro in v.items()}
+                 for k, v in g.get('COMBO', {}).items()}
+
+        taphold = g.get('TAPHOLD', {})
+        oneshot = g.get('ONESHOT', {})
+        chords = g.get('CHORDS', {})
+        self.tap_timeout = g.get('TAP_TIMEOUT', 200) * 1000000
+        self.chord_timeout = g.get('CHORD_TIMEOUT', 50) * 1000000
+        self.oneshot_timeout = g.get('ONESHOT_TIMEOUT', 1000) * 1000000
+        self.timed = bool(taphold or oneshot or chords)
+
+        # REPEAT is True to copy delay and period from the sources, or
+        # (delay, period) in ms
+        self.repeat = g.get('REPEAT', None)
+
+        # DEBOUNCE is a chatter window in ms for the keys of all sources,
+        # DEBOUNCE_MODE 'eager' or 'deferred', see debounce.py
+        self.debounce = g.get('DEBOUNCE', None)
+        self.debounce_mode = g.get('DEBOUNCE_MODE', 'eager')
+
+        # OUTPUT_RATE caps motion frames per second, 0 only merges within a frame
+        rate = g.get('OUTPUT_RATE', None)
+        self.output_period = None if rate is None else 1000000000 // rate if rate else 0
+
+        table = self._compile(modifiers, combo)
+
+        for src, (tap, hold) in taphold.items():
+            table[index(*rawcode(src))] = (TAPHOLD, self._raw(tap), hold if isinstance(hold, str) else self._raw(hold))
+        for src, dst in oneshot.items():
+            table[index(*rawcode(src))] = (ONESHOT, self._raw(dst))
+        for keys, dst in chords.items():
+            assert len(keys) == 2, "chords are pairs of keys"
+            a, b = (index(*rawcode(k)) for k in keys)
+            for i, j in ((a, b), (b, a)):
+                if table[i] is None or table[i][0] != CHORD:
+                    fallback = table[i]
+                    table[i] = (CHORD, fallback[1:] if fallback and fallback[0] == MAP else None, {})
+                table[i][2][j] = self._raw(dst)
+
+        # keys remapped by a layer must remember what they pressed, so the
+        # release goes to the same output even if the layer changed meanwhile
+        layers = g.get('LAYERS', {})
+        for m in layers.values():
+            for src in m:
+                i = index(*rawcode(src))
+                if table[i] is None:
+                    table[i] = (HOLDMAP, None, None)
+                elif table[i][0] == MAP:
+                    table[i] = (HOLDMAP, *table[i][1:])
+
+        self.table = table
+        self.layers = {}
+        for name, m in layers.items():
+            t = table.copy()
+            for src, dst in m.items():
+                t[index(*rawcode(src))] = self._target(dst, HOLDMAP)
+            self.layers[name] = t
+
+        for t in (table, *self.layers.values()):
+            for action in t:
+                if action is not None and action[0] in (LAYER, TAPHOLD):
+                    name = action[-1]
+                    if isinstance(name, str) and name not in self.layers:
+                        raise KeyError(f"unknown layer {name!r}")
+
+    def _raw(self, dst):
+        if isinstance(dst, tuple):
+            output, dst = dst
+            type, code = rawcode(dst)
+            return (self.output_index[output] << OUTPUT_SHIFT) | type, code
+        return rawcode(dst)
+
+    def _target(self, dst, kind=MAP):
+        if isinstance(dst, str):
+            return (LAYER, dst)
+        return (kind, *self._raw(dst))
+
+    # the keymap as {keycode: keycode} when it is nothing but key to key
+    # remaps on a single output, None if anything needs the reader
+    def key_remaps(self):
+        if (len(self.outputs) > 1 or self.modifiers or self.timed or self.layers
+                or self.axes or self.output_period is not None or self.repeat
+                or self.debounce):
+            return None
+        if any(action is not None and action[0] == COMBO for action in self.table):
+            return None
+        mapping = {}
+        for src, dst in self.keymap.items():
+            if not isinstance(src, KEY) or not isinstance(dst, KEY):
+                return None
+            mapping[int(src)] = int(dst)
+        return mapping
+
+    def abs_axes(self):
+        for src, dst in self.keymap.items():
+            output = 0
+            if isinstance(dst, tuple):
+                output, dst = dst
+                output = self.output_index[output]
+            if isinstance(dst, ABS):
+                assert isinstance(src, ABS)
+                yield output, src, dst
+
+    # Looks up the source absinfo of remapped axes, compiles the AXES
+    # transforms against it and derives the absinfo of each output axis.
+    def bind(self, absinfo):
+        self.absinfo = [[] for _ in self.outputs]
+        for output, src, dst in self.abs_axes():
+            info = absinfo[src]
+            spec = self.axes.get(src, None)
+            if spec is not None:
+                lut, lo, hi, shift, info = compile_axis(info, **spec)
+                i = index(*rawcode(src))
+                base = self.table[i]
+                action = (AXIS, base[1], base[2], lut, lo, hi, shift)
+                for t in (self.table, *self.layers.values()):
+                    if t[i] is base:
+                        t[i] = action
+            self.absinfo[output].append((dst, info))
+        return self
+
+    def _compile(self, modifiers, combo):
+        table = [None] * TABLE_SIZE
+
+        for mask, macros in combo.items():
+            for code, macro in macros.items():
+                if not macro:
+                    continue
+                i = index(*rawcode(code))
+                if table[i] is None:
+                    table[i] = (COMBO, {})
+                table[i][1][mask] = macro
+
+        table[index(*rawcode(KEY.KEY_ESC))] = (QUIT,)
+        table[index(*rawcode(KEY.KEY_BACKSPACE))] = (RELOAD,)
+
+        for code, bit in modifiers.items():
+            table[index(*rawcode(code))] = (MOD, bit)
+
+        for src, dst in self.keymap.items():
+            table[index(*rawcode(src))] = self._target(dst)
+
+        table[index(EV.SYN, SYN.REPORT)] = (SYNC,)
+        return table
+
+
+# State machine for layers, tap-hold keys, one-shot modifiers and chords.
+# Output for keys it owns is written to the frame being built by the reader
+# (out); decisions made by a timeout are sent as frames of their own.
+# Nothing is delayed except the tap-hold or chord key itself, and only
+# until the next key press or the configured timeout.
+class Machine:
+
+    def __init__(self, cfg, ring):
+        self.ring = ring
+        self.timer = Timer()
+        self.stack = []
+        self.held = {}
+
+        self.taphold = None
+        self.taphold_deadline = None
+        self.chord = None
+        self.chord_deadline = None
+        self.oneshot_down = {}
+        self.armed = []
+        self.armed_deadline = None
+        self.deferred = []
+
+        self.busy = False
+        self.deadline = None
+        # modifier mask, kept here by the reader for status queries
+        self.mod = 0
+        self.configure(cfg)
+
+    def configure(self, cfg):
+        self.cfg = cfg
+        self.stack = [name for name in self.stack if name in cfg.layers]
+        self._select()
+
+    def _select(self):
+        self.table = self.cfg.layers[self.stack[-1]] if self.stack else self.cfg.table
+
+    def _update(self):
+        self.busy = bool(self.taphold or self.chord or self.oneshot_down or self.armed or self.deferred)
+        deadlines = [d for d in (self.taphold_deadline, self.chord_deadline, self.armed_deadline) if d is not None]
+        deadline = min(deadlines) if deadlines else None
+        if deadline is not None and deadline != self.deadline:
+            self.timer.set(deadline)
+        self.deadline = deadline
+
+    def _split(self, out):
+        out.append(SYN_REPORT)
+        self.ring.put(out.copy())
+        out.clear()
+
+    def _flush(self, frame):
+        if frame:
+            frame.append(SYN_REPORT)
+            self.ring.put(frame)
+
+    def timeout(self):
+        self.timer.read()
+        self.deadline = None
+        self.expire(monotonic_ns())
+
+    def expire(self, now):
+        if self.taphold is not None and self.taphold_deadline <= now:
+            frame = []
+            self._hold(frame)
+            self._flush(frame)
+        if self.chord is not None and self.chord_deadline <= now:
+            frame = []
+            self._fallback(frame)
+            self._flush(frame)
+        if self.armed and self.armed_deadline <= now:
+            self._flush([(*key, 0) for key in self.armed])
+            self.armed.clear()
+            self.armed_deadline = None
+        self._update()
+
+    def synced(self):
+        if self.deferred:
+            self._flush([(*key, 0) for key in self.deferred])
+            self.deferred.clear()
+            self._update()
+
+    def _push(self, name):
+        self.stack.append(name)
+        self._select()
+
+    def _pop(self, name):
+        if name in self.stack:
+            del self.stack[len(self.stack) - 1 - self.stack[::-1].index(name)]
+            self._select()
+
+    def _hold(self, out):
+        i, action = self.taphold
+        self.taphold = self.taphold_deadline = None
+        hold = action[2]
+        self.held[i] = hold
+        if isinstance(hold, str):
+            self._push(hold)
+        else:
+            out.append((*hold, 1))
+
+    def _fallback(self, out):
+        i, action = self.chord
+        self.chord = self.chord_deadline = None
+        fallback = action[1]
+        if fallback is not None:
+            self.held[i] = fallback
+            out.append((*fallback, 1))
+
+    def _release(self, i, value, out):
+        h = self.held.get(i, None) if value else self.held.pop(i, None)
+        if h is None:
+            return
+        if isinstance(h, tuple):
+            out.append((*h, value))
+        elif value:
+            return
+        elif isinstance(h, str):
+            self._pop(h)
+        elif h[0] is not None:
+            out.append((*h[0], 0))
+            h[0] = None
+
+    def interrupt(self, i, out):
+        if self.chord is not None:
+            j, action = self.chord
+            output = action[2].get(i, None)
+            if output is not None:
+                self.chord = self.chord_deadline = None
+                self.held[i] = self.held[j] = [output]
+                out.append((*output, 1))
+                self._update()
+                return True
+            self._fallback(out)
+
+        if self.taphold is not None:
+            self._hold(out)
+
+        for down in self.oneshot_down.values():
+            down[1] = True
+
+        if self.armed:
+            action = self.table[i]
+            if action is None or action[0] != ONESHOT:
+                self.deferred.extend(self.armed)
+                self.armed.clear()
+                self.armed_deadline = None
+
+        self._update()
+        return False
+
+    def handle(self, i, action, value, out):
+        if value != 1:
+            if value == 0:
+                if self.taphold is not None and self.taphold[0] == i:
+                    _, action = self.taphold
+                    self.taphold = self.taphold_deadline = None
+                    self.held[i] = action[1]
+                    out.append((*action[1], 1))
+                    self._split(out)
+                elif self.chord is not None and self.chord[0] == i:
+                    self._fallback(out)
+                    if i in self.held:
+                        self._split(out)
+                elif i in self.oneshot_down:
+                    key, used = self.oneshot_down.pop(i)
+                    if used:
+                        out.append((*key, 0))
+                    else:
+                        self.armed.append(key)
+                        self.armed_deadline = monotonic_ns() + self.cfg.oneshot_timeout
+                    self._update()
+                    return
+            self._release(i, value, out)
+            self._update()
+            return
+
+        kind = action[0]
+        if kind == HOLDMAP:
+            if action[1] is not None:
+                self.held[i] = action[1:]
+                out.append((action[1], action[2], 1))
+        elif kind == LAYER:
+            self.held[i] = action[1]
+            self._push(action[1])
+        elif kind == TAPHOLD:
+            self.taphold = (i, action)
+            self.taphold_deadline = monotonic_ns() + self.cfg.tap_timeout
+        elif kind == ONESHOT:
+            self.oneshot_down[i] = [action[1], False]
+            out.append((*action[1], 1))
+        elif kind == CHORD:
+            self.chord = (i, action)
+            self.chord_deadline = monotonic_ns() + self.cfg.chord_timeout
+        self._update()
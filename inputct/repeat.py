@@ -0,0 +1,68 @@
+from threading import Lock
+from time import monotonic_ns
+
+from .clock import Timer
+from .evdev import EV
+from .remap import SYN_REPORT
+
+# kernel defaults for devices that do not report their own
+DELAY = 250
+PERIOD = 33
+
+
+# Software autorepeat in front of the outputs.  As in the kernel, the most
+# recently pressed key repeats while it is held, first after `delay` ms and
+# then every `period` ms, all from one periodic timerfd.  Repeats coming
+# from the sources are dropped, so keys pressed by remaps, layers and
+# macros all repeat the same way.  The emitter, the macro scheduler and
+# the reader's timer all come through here, one at a time.
+class Repeater:
+
+    def __init__(self, output, delay=DELAY, period=PERIOD):
+        self.output = output
+        self.delay = delay * 1000000
+        self.period = period * 1000000
+        self.timer = Timer()
+        self.key = None
+        self.lock = Lock()
+
+    def write(self, frame):
+        with self.lock:
+            self._write(frame)
+
+    def _write(self, frame):
+        filtered = None
+        for i, event in enumerate(frame):
+            type, code, value = event
+            if type & 0xff == EV.KEY:
+                if value == 2:
+                    if filtered is None:
+                        filtered = list(frame[:i])
+                    continue
+                if value:
+                    self.key = (type, code)
+                    self.timer.set(monotonic_ns() + self.delay, self.period)
+                elif self.key == (type, code):
+                    self.key = None
+                    self.timer.cancel()
+            if filtered is not None:
+                filtered.append(event)
+
+        if filtered is None:
+            self.output.write(frame)
+        elif any(type & 0xff != EV.SYN for type, _, _ in filtered):
+            self.output.write(filtered)
+
+    def timeout(self):
+        with self.lock:
+            # a write that set the timer again since it fired wins
+            key = self.key
+            if self.timer.read() and key is not None:
+                self.output.write([(*key, 2), SYN_REPORT])
+
+    # stops repeating and releases every key held on the outputs
+    def release(self):
+        with self.lock:
+            self.key = None
+            self.timer.cancel()
+            self.output.release()
@@ -0,0 +1,207 @@
+from threading import Event
+from time import monotonic_ns
+
+from .evdev import EV, ABS
+from .clock import Timer
+
+
+def _is_motion(item):
+    if type(item) is not list:
+        return False
+    for type_, code, _ in item:
+        type_ &= 0xff
+        if type_ == EV.ABS:
+            if code == ABS.MT_SLOT:
+                return False
+        elif type_ != EV.REL and type_ != EV.SYN:
+            return False
+    return True
+
+
+# Folds a motion frame into merged, keyed by (type, code): REL deltas are
+# summed, ABS values replaced.  Returns the number of ABS values replaced.
+def _fold(merged, frame):
+    dropped = 0
+    for type_, code, value in frame:
+        if type_ == EV.SYN:
+            continue
+        key = (type_, code)
+        prev = merged.get(key, None)
+        if prev is not None:
+            if type_ & 0xff == EV.REL:
+                value += prev
+            else:
+                dropped += 1
+        merged[key] = value
+    return dropped
+
+def _unfold(merged):
+    frame = [(type_, code, value) for (type_, code), value in merged.items()]
+    frame.append((EV.SYN, 0, 0))
+    return frame
+
+
+# Single-producer single-consumer ring of output frames.  Frames with
+# anything but REL/ABS motion (keys, macros, MT slots) are never dropped: a
+# full ring blocks the producer.  Runs of motion-only frames that pile up
+# behind a slow consumer are folded into one, summing REL deltas and keeping
+# only the latest value of each ABS axis.
+class FrameRing:
+
+    def __init__(self, size=256):
+        assert size > 0 and size & (size - 1) == 0, "size must be a power of two"
+        self.size = size
+        self.mask = size - 1
+        self.slots = [None] * size
+        self.stamps = [None] * size
+        self.stamp = None
+        self.head = 0
+        self.tail = 0
+
+        self._readable = Event()
+        self._writable = Event()
+        self._reader_waiting = False
+        self._writer_waiting = False
+
+        self.pushed = 0
+        self.overflows = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def stats(self):
+        return {
+            'pushed': self.pushed,
+            'pending': self.tail - self.head,
+            'overflows': self.overflows,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+        }
+
+    def put(self, item, stamp=None):
+        full = self.tail - self.head >= self.size
+        if full:
+            self.overflows += 1
+            while self.tail - self.head >= self.size:
+                self._writable.clear()
+                self._writer_waiting = True
+                if self.tail - self.head >= self.size:
+                    self._writable.wait()
+                self._writer_waiting = False
+
+        slot = self.tail & self.mask
+        self.slots[slot] = item
+        if stamp is not None:
+            stamp.append(monotonic_ns())
+        self.stamps[slot] = stamp
+        self.tail += 1
+        self.pushed += 1
+        if self._reader_waiting:
+            self._readable.set()
+        return not full
+
+    def _pop(self):
+        slot = self.head & self.mask
+        item = self.slots[slot]
+        self.slots[slot] = None
+        self.popped = self.stamps[slot]
+        self.stamps[slot] = None
+        self.head += 1
+        if self._writer_waiting:
+            self._writable.set()
+        return item
+
+    def get(self):
+        while self.head == self.tail:
+            self._readable.clear()
+            self._reader_waiting = True
+            if self.head == self.tail:
+                self._readable.wait()
+            self._reader_waiting = False
+
+        item = self._pop()
+        self.stamp = self.popped
+        if self.head == self.tail or not _is_motion(item):
+            return item
+
+        merged = None
+        while self.head != self.tail:
+            following = self.slots[self.head & self.mask]
+            if not _is_motion(following):
+                break
+            if merged is None:
+                merged = {}
+                self.dropped += _fold(merged, item)
+            self.dropped += _fold(merged, self._pop())
+            self.coalesced += 1
+
+        if merged is None:
+            return item
+        return _unfold(merged)
+
+    def __iter__(self):
+        while True:
+            yield self.get()
+
+
+# Output stage in front of a FrameRing that sends at most one motion frame
+# per period.  Motion frames arriving sooner are folded into the next one,
+# which goes out when the period ends (timer) or right before the next
+# frame with keys in it; those are never held back.  A period of 0 only
+# folds repeated codes within a frame.
+class Limiter:
+
+    def __init__(self, ring, period=0):
+        self.ring = ring
+        self.period = period
+        self.timer = Timer()
+        self.merged = {}
+        self.stamp = None
+        self.next = 0
+        self.armed = False
+
+        self.coalesced = 0
+        self.dropped = 0
+
+    def stats(self):
+        return {
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+        }
+
+    def put(self, item, stamp=None):
+        if not _is_motion(item):
+            if self.merged:
+                self.flush(monotonic_ns())
+            return self.ring.put(item, stamp)
+
+        if self.merged:
+            self.coalesced += 1
+        else:
+            self.stamp = stamp
+        self.dropped += _fold(self.merged, item)
+        now = monotonic_ns()
+        if now >= self.next:
+            return self.flush(now)
+        if not self.armed:
+            self.timer.set(self.next)
+            self.armed = True
+        return True
+
+    def flush(self, now):
+        # the pending motion goes out now, a timer armed for it is stale
+        if self.armed:
+            self.timer.cancel()
+            self.armed = False
+        frame = _unfold(self.merged)
+        self.merged = {}
+        self.next = now + self.period
+        return self.ring.put(frame, self.stamp)
+
+    def timeout(self):
+        self.timer.read()
+        self.armed = False
+        if self.merged:
+            self.flush(monotonic_ns())
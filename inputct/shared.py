@@ -0,0 +1,168 @@
+import os
+import mmap
+import struct
+from array import array
+
+from .evdev import input_event_struct, EV, SYN, ABS
+
+# Live state of a source device in a small shared memory file, so other
+# processes can ask whether a key is held or where an axis is without
+# opening the device or issuing ioctls:
+#
+#   MAGIC seq:u64 frames:u64 time:i64 keys:u8[96] abs:i32[64]
+#
+# keys is the EVIOCGKEY bitmap, abs the current value of every ABS code,
+# time the kernel timestamp in microseconds of the last frame, all as of
+# the end of that frame.  The writer makes seq odd, updates the block and
+# makes seq even again; readers copy what they need between two reads of
+# seq and retry until both are the same even value (a seqlock).  Nothing
+# ever blocks the writer.
+
+MAGIC = b"INPUTST\x01"
+KEY_BYTES = 96
+ABS_COUNT = 64
+
+header_struct = struct.Struct("<8sQQq")
+seq_struct = struct.Struct("<Q")
+SEQ = 8
+FRAMES = 16
+KEYS = header_struct.size
+AXES = KEYS + KEY_BYTES
+SIZE = AXES + ABS_COUNT * 4
+
+
+# Wraps a source device: every read() also folds the events read into the
+# state block at `path`, a whole frame at a time.  Everything else is the
+# device's own.
+class Publisher:
+
+    def __init__(self, dev, path):
+        self.dev = dev
+        self.path = path
+        self.keys = 0
+        self.axes = array('i', bytes(ABS_COUNT * 4))
+        self.pending = []
+        self.dropped = False
+        self.frames = 0
+        self.time = 0
+
+        tmp = f"{path}.{os.getpid()}"
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+        try:
+            os.ftruncate(fd, SIZE)
+            self.mm = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+        self.mm[:header_struct.size] = header_struct.pack(MAGIC, 0, 0, 0)
+        self._resync()
+        self._publish()
+        # readers only ever find a complete block at `path`
+        os.rename(tmp, path)
+
+    def __getattr__(self, name):
+        return getattr(self.dev, name)
+
+    def fileno(self):
+        return self.dev.fileno()
+
+    def close(self):
+        if self.mm is not None:
+            os.unlink(self.path)
+            self.mm.close()
+            self.mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, exc, tb):
+        self.close()
+
+    def _resync(self):
+        self.keys = int.from_bytes(self.dev.get_key(), 'little')
+        for code in self.dev.capabilities.get(ABS, ()):
+            if code < ABS_COUNT:
+                self.axes[code] = self.dev.get_abs(code).value
+
+    def _publish(self):
+        mm = self.mm
+        seq = seq_struct.unpack_from(mm, SEQ)[0]
+        seq_struct.pack_into(mm, SEQ, seq + 1)
+        struct.pack_into("<Qq", mm, FRAMES, self.frames, self.time)
+        mm[KEYS:AXES] = self.keys.to_bytes(KEY_BYTES, 'little')
+        mm[AXES:SIZE] = self.axes.tobytes()
+        seq_struct.pack_into(mm, SEQ, seq + 2)
+
+    def read(self, count=64):
+        data = os.read(self.dev.fd, count * input_event_struct.size)
+        pending = self.pending
+        changed = False
+        for sec, usec, type, code, value in input_event_struct.iter_unpack(data):
+            if type != EV.SYN:
+                if not self.dropped:
+                    pending.append((type, code, value))
+            elif code == SYN.REPORT:
+                if self.dropped:
+                    self.dropped = False
+                    self._resync()
+                else:
+                    for type, code, value in pending:
+                        if type == EV.KEY:
+                            if value:
+                                self.keys |= 1 << code
+                            else:
+                                self.keys &= ~(1 << code)
+                        elif type == EV.ABS and code < ABS_COUNT:
+                            self.axes[code] = value
+                pending.clear()
+                self.frames += 1
+                self.time = sec * 1000000 + usec
+                changed = True
+            elif code == SYN.DROPPED:
+                self.dropped = True
+                pending.clear()
+        if changed:
+            self._publish()
+        return input_event_struct.iter_unpack(data)
+
+
+# Read side of a state block, safe to use from any number of processes
+class SharedState:
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), SIZE, prot=mmap.PROT_READ)
+        assert self.mm[:len(MAGIC)] == MAGIC, f"{path} is not a device state block"
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, exc, tb):
+        self.close()
+
+    def _read(self, read):
+        mm = self.mm
+        while True:
+            seq = seq_struct.unpack_from(mm, SEQ)[0]
+            if seq & 1:
+                os.sched_yield()
+                continue
+            value = read(mm)
+            if seq_struct.unpack_from(mm, SEQ)[0] == seq:
+                return value
+
+    def key(self, code):
+        return bool(self._read(lambda mm: mm[KEYS + (code >> 3)]) >> (code & 7) & 1)
+
+    def axis(self, code):
+        return self._read(lambda mm: struct.unpack_from("<i", mm, AXES + code * 4)[0])
+
+    # (frames, time, held keys as a bitmap int, all axis values)
+    def snapshot(self):
+        return self._read(lambda mm: (*struct.unpack_from("<Qq", mm, FRAMES),
+                                      int.from_bytes(mm[KEYS:AXES], 'little'),
+                                      struct.unpack_from(f"<{ABS_COUNT}i", mm, AXES)))
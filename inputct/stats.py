@@ -0,0 +1,169 @@
+from threading import Thread, Event, local
+from time import thread_time_ns
+from random import randint
+
+# log-linear buckets: 2**(PRECISION-1) buckets per power of two, so any
+# recorded value is known to within ~3%
+PRECISION = 6
+MAX_SHIFT = 40
+
+_HALF = 1 << (PRECISION - 1)
+
+
+def _bucket(v):
+    if v < (1 << PRECISION):
+        return v if v > 0 else 0
+    s = v.bit_length() - PRECISION
+    if s > MAX_SHIFT:
+        s = MAX_SHIFT
+        v = (1 << (MAX_SHIFT + PRECISION)) - 1
+    return (s << (PRECISION - 1)) + (v >> s)
+
+def _value(i):
+    if i < (1 << PRECISION):
+        return i
+    s = (i >> (PRECISION - 1)) - 1
+    return (i - (s << (PRECISION - 1))) << s
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * ((MAX_SHIFT + 2) << (PRECISION - 1))
+        self.count = 0
+        self.max = 0
+
+    def record(self, v):
+        self.counts[_bucket(v)] += 1
+        self.count += 1
+        if v > self.max:
+            self.max = v
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return _value(i)
+        return self.max
+
+
+STAGES = ('kernel_read', 'read_map', 'map_enqueue', 'enqueue_emit', 'total')
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+# Per-frame latency of the virtual pipeline.  A stamp is the list
+# [kernel, read, mapped, enqueued] of CLOCK_MONOTONIC ns, completed by the
+# emitter with the time the frame was written.
+class Stats:
+
+    def __init__(self):
+        self.histograms = {stage: Histogram() for stage in STAGES}
+
+    def record(self, stamp, emitted):
+        kernel, read, mapped, enqueued = stamp
+        h = self.histograms
+        h['kernel_read'].record(read - kernel)
+        h['read_map'].record(mapped - read)
+        h['map_enqueue'].record(enqueued - mapped)
+        h['enqueue_emit'].record(emitted - enqueued)
+        h['total'].record(emitted - kernel)
+
+    def report(self):
+        return {
+            stage: dict(count=h.count,
+                        **{f'p{p:g}_us': h.percentile(p) / 1000 for p in PERCENTILES},
+                        max_us=h.max / 1000)
+            for stage, h in self.histograms.items()
+        }
+
+    def dump(self):
+        for stage, r in self.report().items():
+            print(f"{stage:>12}:", ' '.join(f"{k}={v:g}" for k, v in r.items()))
+
+    def spawn(self, interval):
+        assert interval > 0, interval
+        self.stopped = Event()
+
+        def run():
+            while not self.stopped.wait(interval):
+                self.dump()
+
+        Thread(target=run, daemon=True).start()
+        return self
+
+
+STAGE_NAMES = ('read', 'map', 'emit')
+
+
+# Hooks into the virtual pipeline, called by the reader after every read
+# (on_read_batch), for every finished frame before it is queued (on_frame)
+# and by the emitter after every frame written (on_emit).  Hooks must not
+# consume the batches or keep the frames.  Without hooks the pipeline has
+# no calls at all, not even to no-op methods.
+class Hooks:
+
+    def on_read_batch(self, batches):
+        pass
+
+    def on_frame(self, frame):
+        pass
+
+    def on_emit(self, frame):
+        pass
+
+
+# Samples the thread CPU time between two hook calls on the same thread,
+# on average once every `every` calls (randomised so the samples do not
+# lock onto the read/map/emit cycle), and charges it to the stage of the later call:
+# reading and decoding for on_read_batch, mapping for on_frame, queueing
+# and writing for on_emit.  Call counts are exact, CPU time is estimated
+# from the samples.
+class Profiler(Hooks):
+
+    def __init__(self, every=16):
+        self.every = every
+        self.local = local()
+        self.calls = dict.fromkeys(STAGE_NAMES, 0)
+        self.samples = dict.fromkeys(STAGE_NAMES, 0)
+        self.cpu = dict.fromkeys(STAGE_NAMES, 0)
+
+    def _tick(self, stage):
+        self.calls[stage] += 1
+        t = self.local
+        try:
+            t.countdown -= 1
+        except AttributeError:
+            t.countdown = randint(1, 2 * self.every - 1)
+            t.mark = None
+        if t.mark is not None:
+            self.cpu[stage] += thread_time_ns() - t.mark
+            self.samples[stage] += 1
+            t.mark = None
+        if t.countdown <= 0:
+            t.countdown = randint(1, 2 * self.every - 1)
+            t.mark = thread_time_ns()
+
+    def on_read_batch(self, batches):
+        self._tick('read')
+
+    def on_frame(self, frame):
+        self._tick('map')
+
+    def on_emit(self, frame):
+        self._tick('emit')
+
+    def report(self):
+        result = {}
+        for stage in STAGE_NAMES:
+            calls, samples, cpu = self.calls[stage], self.samples[stage], self.cpu[stage]
+            mean = cpu / samples if samples else 0
+            result[stage] = dict(calls=calls, samples=samples, mean_us=mean / 1000, cpu_ms=mean * calls / 1000000)
+        return result
+
+    def dump(self):
+        for stage, r in self.report().items():
+            print(f"{stage:>5}:", ' '.join(f"{k}={v:g}" for k, v in r.items()))
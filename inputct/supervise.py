@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import select
+import signal
+import tempfile
+import subprocess
+from datetime import datetime
+from time import monotonic_ns
+
+from .clock import Timer
+from .control import request
+from .inotify import Inotify, IN_CLOSE_WRITE, IN_MOVED_TO, IN_MOVED_FROM, IN_DELETE
+
+BACKOFF_MIN = 1000000000
+BACKOFF_MAX = 60000000000
+# a worker that stayed up this long starts over at BACKOFF_MIN
+STABLE = 60000000000
+STOP_TIMEOUT = 2
+
+
+# One `inputct virtual` process for one config, pinned to one cpu and
+# reachable through its control socket.  A worker that exits with an error
+# is started again after a backoff that doubles with every quick crash; one
+# that exits cleanly (QUIT key) stays down until its config changes.
+class Worker:
+
+    def __init__(self, config, rundir, cpu, engine):
+        self.config = config
+        self.name = os.path.splitext(os.path.basename(config))[0]
+        self.socket = os.path.join(rundir, f"{self.name}.sock")
+        self.cpu = cpu
+        self.engine = engine
+        self.proc = None
+        self.pidfd = None
+        self.started = None
+        self.restarts = 0
+        self.backoff = BACKOFF_MIN
+        self.restart_at = None
+
+    def start(self):
+        # the worker pins itself before it starts any threads, which a
+        # later sched_setaffinity on its pid would miss
+        args = [sys.executable, '-m', 'inputct', 'virtual', '--engine', self.engine, '--control', self.socket]
+        if self.cpu is not None:
+            args += ['--cpus', str(self.cpu)]
+        self.proc = subprocess.Popen(args + [self.config])
+        self.pidfd = os.pidfd_open(self.proc.pid)
+        self.started = monotonic_ns()
+        self.restart_at = None
+        print(datetime.now(), self.name, "started", self.proc.pid, "cpu", self.cpu)
+
+    def reap(self, now):
+        code = self.proc.wait()
+        os.close(self.pidfd)
+        self.pidfd = None
+        self.proc = None
+        if code == 0:
+            print(datetime.now(), self.name, "exited")
+            return
+        if now - self.started >= STABLE:
+            self.backoff = BACKOFF_MIN
+        self.restart_at = now + self.backoff
+        print(datetime.now(), self.name, "failed with", code, "restarting in", self.backoff / 1e9, "s")
+        self.backoff = min(self.backoff * 2, BACKOFF_MAX)
+        self.restarts += 1
+
+    def stop(self):
+        if self.proc is not None:
+            self.proc.send_signal(signal.SIGINT)
+            try:
+                self.proc.wait(STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+            os.close(self.pidfd)
+            self.pidfd = None
+            self.proc = None
+        self.restart_at = None
+
+    def stats(self):
+        result = dict(pid=None if self.proc is None else self.proc.pid, cpu=self.cpu, restarts=self.restarts)
+        if self.proc is None:
+            result['state'] = 'waiting' if self.restart_at is not None else 'stopped'
+            return result
+        result['state'] = 'running'
+        try:
+            result['stats'] = request(self.socket, 'stats', timeout=1)
+        except (OSError, ValueError) as e:
+            result['error'] = str(e)
+        return result
+
+
+def aggregate(workers):
+    total = dict(running=0, events=0, frames=0, overflows=0, coalesced=0, dropped=0,
+                 macros=0, macro_steps=0, macro_late_max_us=0)
+    per = {}
+    for w in workers.values():
+        r = per[w.name] = w.stats()
+        if r['state'] == 'running':
+            total['running'] += 1
+        s = r.get('stats', None)
+        if not s or 'error' in s:
+            continue
+        sink = s['sink']
+        total['events'] += s['events']
+        total['frames'] += sink.get('pushed', sink.get('frames', 0))
+        for key in ('overflows', 'coalesced', 'dropped'):
+            total[key] += sink.get(key, 0) + s['limiter'].get(key, 0)
+        total['macros'] += s['macro']['macros']
+        total['macro_steps'] += s['macro']['steps']
+        total['macro_late_max_us'] = max(total['macro_late_max_us'], s['macro']['late_max_us'])
+    return dict(total=total, workers=per)
+
+
+def main(directory, engine='thread', cpus=None, interval=10):
+    directory = os.path.abspath(directory)
+    cpus = sorted(cpus or os.sched_getaffinity(0))
+    rundir = tempfile.mkdtemp(prefix='inputct-', dir=os.environ.get('XDG_RUNTIME_DIR', None))
+
+    workers = {}
+    by_pidfd = {}
+    poll = select.epoll()
+
+    def add(config):
+        used = {w.cpu for w in workers.values()}
+        cpu = next((c for c in cpus if c not in used), cpus[len(workers) % len(cpus)])
+        w = workers[config] = Worker(config, rundir, cpu, engine)
+        launch(w)
+
+    def launch(w):
+        w.start()
+        by_pidfd[w.pidfd] = w
+        poll.register(w.pidfd, select.EPOLLIN)
+
+    def remove(config):
+        w = workers.pop(config)
+        if w.pidfd is not None:
+            del by_pidfd[w.pidfd]
+            poll.unregister(w.pidfd)
+        w.stop()
+        print(datetime.now(), w.name, "removed")
+
+    r, wakeup = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1):
+        signal.signal(signum, lambda signum, frame: None)
+    signal.set_wakeup_fd(wakeup)
+
+    inotify = Inotify()
+    inotify.add_watch(directory, IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE)
+    timer = Timer()
+    for fd in (r, inotify, timer):
+        poll.register(fd, select.EPOLLIN)
+
+    period = int(interval * 1000000000) if interval else None
+    next_stats = monotonic_ns() + period if period else None
+
+    try:
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.py'):
+                add(os.path.join(directory, name))
+
+        running = True
+        while running:
+            deadlines = [w.restart_at for w in workers.values() if w.restart_at is not None]
+            if next_stats is not None:
+                deadlines.append(next_stats)
+            if deadlines:
+                timer.set(min(deadlines))
+            else:
+                timer.cancel()
+
+            for fd, _ in poll.poll():
+                now = monotonic_ns()
+                if fd == r:
+                    for signum in os.read(r, 64):
+                        if signum == signal.SIGUSR1:
+                            print(json.dumps(aggregate(workers)), flush=True)
+                        else:
+                            running = False
+                elif fd == inotify.fileno():
+                    for _, mask, _, name in inotify.read():
+                        if not name.endswith('.py'):
+                            continue
+                        config = os.path.join(directory, name)
+                        if mask & (IN_MOVED_FROM | IN_DELETE):
+                            if config in workers:
+                                remove(config)
+                        elif config not in workers:
+                            add(config)
+                        elif workers[config].proc is None:
+                            # a stopped or crashing worker gets a fresh start
+                            # when its config is fixed, a running one reloads
+                            w = workers[config]
+                            w.backoff = BACKOFF_MIN
+                            launch(w)
+                elif fd == timer.fileno():
+                    timer.read()
+                    for w in workers.values():
+                        if w.restart_at is not None and w.restart_at <= now:
+                            launch(w)
+                    if next_stats is not None and next_stats <= now:
+                        next_stats = now + period
+                        print(json.dumps(aggregate(workers)), flush=True)
+                else:
+                    w = by_pidfd.pop(fd)
+                    poll.unregister(fd)
+                    w.reap(now)
+    finally:
+        for config in list(workers):
+            remove(config)
+        signal.set_wakeup_fd(-1)
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1):
+            signal.signal(signum, signal.SIG_DFL if signum != signal.SIGINT else signal.default_int_handler)
+        os.close(r)
+        os.close(wakeup)
+        inotify.close()
+        timer.close()
+        poll.close()
+        os.rmdir(rundir)
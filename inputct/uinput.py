@@ -4,7 +4,7 @@ from ctypes import Structure, sizeof, c_char, c_uint16, c_uint32, memmove, creat
 from contextlib import contextmanager
 from functools import cached_property
 
-from .evdev import input_id, input_absinfo, input_event, BUS, EV, SYN, KEY, REL, ABS, MSC, SW, LED, SND, REP, FF, FF_STATUS, INPUT_PROP
+from .evdev import input_id, input_absinfo, input_event, input_event_struct, BUS, EV, SYN, KEY, REL, ABS, MSC, SW, LED, SND, REP, FF, FF_STATUS, INPUT_PROP
 
 class uinput_setup(Structure):
     _fields_ = [
@@ -116,6 +116,10 @@ class UInputDevice:
         e.value = value
         os.write(self.fd, e)
 
+    def write(self, events):
+        pack = input_event_struct.pack
+        os.write(self.fd, b''.join([pack(0, 0, type, code, value) for type, code, value in events]))
+
     @contextmanager
     def syn(self):
         yield
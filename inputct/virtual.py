@@ -1,29 +1,29 @@
-from ctypes.util import find_library
-from functools import reduce
-from ctypes import CDLL, Structure, POINTER, c_long
+import os
+import select
+import signal
 from traceback import print_exc
 from datetime import datetime
-from threading import Thread
-from queue import Queue, Empty
+from threading import Thread, Lock, main_thread
+from contextlib import ExitStack
+from time import monotonic_ns
+from ctypes import c_int
+from operator import length_hint
 
-from .evdev import EventDevice, grab, EV, SYN, KEY, REL, ABS, MSC, SW, LED, SND, REP, FF, FF_STATUS, INPUT_PROP
+from .evdev import EventDevice, grab, _bits, EV, SYN, KEY, REL, ABS, MSC, SW, LED, SND, REP, FF, FF_STATUS, INPUT_PROP
 from .uinput import UInputDevice
-
-
-libc = CDLL(find_library('c'))
-class timespec(Structure):
-    _fields_ = [('sec', c_long),
-                ('nsec', c_long)]
-
-libc.nanosleep.argtypes = [POINTER(timespec), POINTER(timespec)]
-
-_req = timespec()
-_rem = timespec()
-
-def nanosleep(ns):
-    _req.sec = ns // 1000000000
-    _req.nsec = ns % 1000000000
-    libc.nanosleep(_req, _rem)
+from .loopback import LoopbackDevice, LoopbackOutput
+from .shared import Publisher
+from .debounce import Debouncer
+from .ring import FrameRing, Limiter
+from .macro import Macro, MacroScheduler
+from .remap import Config, Machine, MAP, AXIS, SYNC, MOD, COMBO, QUIT, RELOAD, HOLDMAP, SYN_REPORT, OUTPUT_SHIFT
+from .clock import CLOCK_MONOTONIC
+from .stats import Stats, Profiler
+from .control import Server
+from .realtime import enable as enable_realtime
+from .keymap import Keymap
+from .repeat import Repeater, DELAY as REPEAT_DELAY, PERIOD as REPEAT_PERIOD
+from .inotify import Inotify, IN_CLOSE_WRITE, IN_MOVED_TO
 
 def reload(config):
     try:
@@ -49,95 +49,678 @@ def reload(config):
         g['FF_STATUS'] = FF_STATUS
         g['INPUT_PROP'] = INPUT_PROP
         exec(code, g)
-        name = g.get('NAME', config)
-        events = g.get('EVENTS', ())
-        props = g.get('PROPS', ())
-        modifiers = {k: (1<<i) for i, k in enumerate(g.get('MODIFIERS', ()))}
-        mask = reduce(lambda a,b: (a|b), modifiers.values(), 0)
-        keymap = g['KEYMAP']
-        combo = g.get('COMBO', {})
-        combo = {reduce(lambda acc, m: (acc|modifiers[m]), k, 0): v
-                 for k, v in combo.items()}
-        return name, events, props, keymap, modifiers, mask, combo
+        return Config(config, g)
     except Exception:
         print_exc()
         return
 
-def emitter(queue, output):
-    while True:
-        items = queue.get()
+# what the devices and filters were set up from at startup
+def _fixed(cfg):
+    # by type as well, REL.X == ABS.X
+    return ([(name, [(type(e), e) for e in events], [(type(p), p) for p in props])
+             for name, events, props in cfg.outputs],
+            cfg.repeat, cfg.debounce, cfg.debounce_mode)
+
+# the absinfo the output axes were created with, all but the current value
+def _axes(cfg):
+    return [[(type(dst), dst, info.minimum, info.maximum, info.fuzz, info.flat, info.resolution)
+             for dst, info in abs] for abs in cfg.absinfo]
+
+# Reloads the config on a background thread whenever the file is written
+# or replaced, or when request() is called.  The reader picks up self.cfg
+# at the next frame boundary; a broken config, or one that changes what
+# only takes effect at startup, leaves the old one in place.
+class Watcher:
+
+    def __init__(self, config, cfg, absinfo):
+        self.config = config
+        self.cfg = cfg
+        self.absinfo = absinfo
+        dirname, self.basename = os.path.split(os.path.abspath(config))
+        self.inotify = Inotify()
+        self.inotify.add_watch(dirname, IN_CLOSE_WRITE | IN_MOVED_TO)
+        self.wakeup = os.eventfd(0, os.EFD_CLOEXEC)
+
+    def request(self):
+        os.eventfd_write(self.wakeup, 1)
+
+    def run(self):
+        poll = select.epoll()
+        poll.register(self.inotify, select.EPOLLIN)
+        poll.register(self.wakeup, select.EPOLLIN)
+
         while True:
+            changed = False
+            for fd, _ in poll.poll():
+                if fd == self.wakeup:
+                    os.eventfd_read(self.wakeup)
+                    changed = True
+                else:
+                    for _, _, _, name in self.inotify.read():
+                        if name == self.basename:
+                            changed = True
+
+            if changed:
+                result = reload(self.config)
+                if result and _fixed(result) != _fixed(self.cfg):
+                    print(datetime.now(), "reload rejected: OUTPUTS, EVENTS, PROPS, REPEAT and DEBOUNCE need a restart")
+                    continue
+                if result:
+                    try:
+                        result.bind(self.absinfo)
+                    except Exception:
+                        print_exc()
+                        continue
+                    if _axes(result) != _axes(self.cfg):
+                        print(datetime.now(), "reload rejected: output axis ranges from AXES need a restart")
+                        continue
+                    self.cfg = result
+                    print(datetime.now(), "reload success")
+
+    def spawn(self):
+        Thread(target=self.run, daemon=True).start()
+        return self
+
+# Splits frames between the output devices, one write per device.  Keys
+# held on them are one bit each in a single int, indexed by
+# (output << 10) | code, so they can all be let go when the frames that
+# would release them are not coming (see RELEASE).  The emitter and the
+# macro scheduler both write here, hence the lock.
+class Outputs:
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.single = devices[0] if len(devices) == 1 else None
+        self.held = 0
+        self.lock = Lock()
+
+    def write(self, frame):
+        with self.lock:
+            for type, code, value in frame:
+                if type & 0xff == EV.KEY:
+                    bit = 1 << (((type >> OUTPUT_SHIFT) << 10) | code)
+                    if value:
+                        self.held |= bit
+                    else:
+                        self.held &= ~bit
+            self._write(frame)
+
+    def _write(self, frame):
+        if self.single is not None:
+            self.single.write(frame)
+            return
+
+        # a macro step can hold several frames, each is split on its own
+        groups = {}
+        for type, code, value in frame:
+            if type == EV.SYN:
+                if code == SYN.REPORT:
+                    self._flush(groups)
+                continue
+            events = groups.get(type >> OUTPUT_SHIFT, None)
+            if events is None:
+                events = groups[type >> OUTPUT_SHIFT] = []
+            events.append((type & 0xff, code, value))
+        self._flush(groups)
+
+    def _flush(self, groups):
+        for output, events in groups.items():
+            events.append(SYN_REPORT)
+            self.devices[output].write(events)
+        groups.clear()
+
+    def release(self):
+        with self.lock:
+            held = self.held
+            self.held = 0
+            frame = [(((index >> 10) << OUTPUT_SHIFT) | EV.KEY, index & 0x3ff, 0) for index in _bits(held)]
+            if frame:
+                frame.append(SYN_REPORT)
+                self._write(frame)
+
+# Queued like a frame, lets go of every key held on the outputs once the
+# frames before it are out: a paused reader releases nothing.
+RELEASE = object()
+
+# Hands frames straight to the outputs and macros to the scheduler
+class Direct:
+
+    def __init__(self, output, scheduler, latency=None, hooks=None):
+        self.output = output
+        self.scheduler = scheduler
+        self.latency = latency
+        self.hooks = hooks
+        self.frames = 0
+
+    def stats(self):
+        return {'frames': self.frames}
+
+    def put(self, items, stamp=None):
+        if stamp is not None:
+            stamp.append(monotonic_ns())
+        self.emit(items, stamp)
+        return True
+
+    def emit(self, items, stamp=None):
+        if type(items) is Macro:
+            self.scheduler.start(items)
+        elif items is RELEASE:
+            self.output.release()
+        else:
+            self.output.write(items)
+            self.frames += 1
+            if stamp is not None:
+                self.latency.record(stamp, monotonic_ns())
+            if self.hooks is not None:
+                self.hooks.on_emit(items)
+
+# Queued last, ends the emitter once everything before it is out
+STOP = object()
+
+# Drains the ring into the outputs on a thread of its own until STOP, so
+# nothing queued is lost when the reader returns.  A failed emit ends the
+# process: the reader is interrupted, once and only while it runs, and the
+# ring is drained without emitting from then on so it never blocks on a
+# full one.  An interrupt that lands just before a lone source's blocking
+# read takes effect with the next event.
+class Emitter:
+
+    def __init__(self, ring, direct):
+        self.ring = ring
+        self.direct = direct
+        self.lock = Lock()
+        self.pumping = True
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        ring = self.ring
+        emit = self.direct.emit
+        failed = False
+        for items in ring:
+            if items is STOP:
+                return
+            if failed:
+                continue
             try:
-                items = queue.get_nowait()
-            except Empty:
-                break
+                emit(items, ring.stamp)
+            except Exception:
+                print_exc()
+                failed = True
+                with self.lock:
+                    if self.pumping:
+                        self.pumping = False
+                        signal.pthread_kill(main_thread().ident, signal.SIGINT)
 
-        for c in items:
-            if isinstance(c, int):
-                nanosleep(c)
-            else:
-                output.emit(*c)
+    def stop(self):
+        with self.lock:
+            self.pumping = False
+        self.ring.put(STOP)
+        self.thread.join()
 
-def main(config, device):
-    NAME, EVENTS, PROPS, KEYMAP, MODIFIERS, MASK, COMBO = reload(config)
+# Turns SIGINT/SIGTERM into a clean exit and SIGHUP into a reload request
+# for the event loop, through the signal wakeup fd.
+class Control:
 
-    queue = Queue()
+    def __init__(self, watcher):
+        self.watcher = watcher
+        self.r, self.w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signum, lambda signum, frame: None)
+        signal.set_wakeup_fd(self.w)
 
-    with EventDevice(device) as dev:
-        with grab(dev):
-            abs = []
+    def fileno(self):
+        return self.r
 
-            for src, dst in KEYMAP.items():
-                if not isinstance(dst, ABS):
-                    continue
-                assert isinstance(src, ABS)
-                abs.append((dst, dev.get_abs(src)))
+    def close(self):
+        signal.set_wakeup_fd(-1)
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL if signum != signal.SIGINT else signal.default_int_handler)
+        os.close(self.r)
+        os.close(self.w)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, exc, tb):
+        self.close()
+
+    def handle(self):
+        for signum in os.read(self.r, 64):
+            if signum == signal.SIGHUP:
+                self.watcher.request()
+            elif signum in (signal.SIGINT, signal.SIGTERM):
+                return False
+
+# Answers control socket commands.  They run on the reader's event loop,
+# so reader and machine state can be touched directly.
+class Commands:
+
+    def __init__(self, watcher, sources, sink, scheduler, latency, profiler=None):
+        self.watcher = watcher
+        self.sources = sources
+        self.sink = sink
+        self.scheduler = scheduler
+        self.latency = latency
+        self.profiler = profiler
+        self.reader = self.machine = self.limiter = None
+
+    def attach(self, reader, machine, limiter):
+        self.reader = reader
+        self.machine = machine
+        self.limiter = limiter
+
+    def __call__(self, command, *args):
+        method = getattr(self, f"do_{command}", None)
+        if method is None:
+            return {"error": f"unknown command {command!r}"}
+        return method(*args)
 
-            with UInputDevice(NAME.encode(), EVENTS, PROPS, abs) as output:
-                Thread(target=emitter, args=(queue, output), daemon=True).start()
+    def do_reload(self):
+        self.watcher.request()
+        return {"ok": True}
 
-                mod = 0
-                pending_key = []
+    # releasing the grab hands the sources back to everyone else, keys
+    # held on the outputs are let go as they would never see their release
+    def do_pause(self):
+        if not self.reader.paused:
+            for s in self.sources:
+                s.dev.grab(0)
+                s.pending = []
+            self.reader.paused = True
+            self.sink.put(RELEASE)
+        return {"ok": True}
 
-                for event in dev:
-                    if event.type == EV.SYN:
-                        if event.code != SYN.REPORT or event.value != 0:
-                            continue
-                        if not pending_key:
-                            continue
+    def do_resume(self):
+        if self.reader is not None and self.reader.paused:
+            for s in self.sources:
+                s.dev.grab(1)
+            self.reader.paused = False
+        return {"ok": True}
 
-                        pending_key.append((event.code, event.value))
-                        queue.put(pending_key)
-                        pending_key = []
+    def do_stats(self):
+        return {
+            'events': self.reader.events,
+            'debounced': sum(getattr(s.dev, 'suppressed', 0) for s in self.sources),
+            'sink': self.sink.stats(),
+            'limiter': self.limiter.stats(),
+            'macro': self.scheduler.stats(),
+            'latency': None if self.latency is None else self.latency.report(),
+            'profile': None if self.profiler is None else self.profiler.report(),
+        }
+
+    def do_state(self):
+        machine = self.machine
+        cfg = machine.cfg
+        return {
+            'config': cfg.name,
+            'paused': self.reader.paused,
+            'sources': [s.name for s in self.sources],
+            'outputs': [name for name, _, _ in cfg.outputs],
+            'layers': machine.stack,
+            'modifiers': [getattr(k, 'name', str(k)) for b, k in enumerate(cfg.modifiers) if machine.mod >> b & 1],
+            'held': [[i >> 10, i & 0x3ff] for i in machine.held],
+            'busy': machine.busy,
+        }
+
+# Runs a pure key remap in the kernel keymaps of the sources instead of
+# grabbing them: no reader, no uinput device, nothing added per event.
+# Keys the config does not mention pass through unchanged.  The original
+# tables come back on exit; a config that stops qualifying on reload is
+# ignored and the current mapping kept.
+class Offload:
+
+    def __init__(self, config, keymaps):
+        self.config = config
+        self.keymaps = keymaps
+        dirname, self.basename = os.path.split(os.path.abspath(config))
+        self.inotify = Inotify()
+        self.inotify.add_watch(dirname, IN_CLOSE_WRITE | IN_MOVED_TO)
+
+    def missing(self, mapping):
+        return set(mapping).difference(*(k.keycodes for k in self.keymaps))
+
+    def apply(self, mapping):
+        for k in self.keymaps:
+            k.apply(mapping)
+
+    def request(self):
+        cfg = reload(self.config)
+        if cfg is None:
+            return
+        mapping = cfg.key_remaps()
+        if mapping is None or self.missing(mapping):
+            print(datetime.now(), "config no longer fits the kernel keymap, keeping the previous one")
+            return
+        self.apply(mapping)
+        print(datetime.now(), "reload success")
+
+    def run(self):
+        with Control(self) as signals:
+            poll = select.epoll()
+            poll.register(signals, select.EPOLLIN)
+            poll.register(self.inotify, select.EPOLLIN)
+            while True:
+                for fd, _ in poll.poll():
+                    if fd == signals.fileno():
+                        if signals.handle() is False:
+                            return
+                    elif any(name == self.basename for _, _, _, name in self.inotify.read()):
+                        self.request()
+
+def offload_keymap(config, cfg, devices):
+    mapping = cfg.key_remaps()
+    if mapping is None:
+        print(datetime.now(), "offload: config needs more than key remaps, running in userspace")
+        return False
+    keymaps = [Keymap(dev) for dev in devices]
+    o = Offload(config, keymaps)
+    missing = o.missing(mapping)
+    if missing:
+        print(datetime.now(), "offload: no scancode for", [KEY(c) for c in sorted(missing)], "running in userspace")
+        return False
+    with ExitStack() as stack:
+        for k in keymaps:
+            stack.enter_context(k)
+        o.apply(mapping)
+        print(datetime.now(), "offload: kernel keymap programmed")
+        o.run()
+    return True
+
+class Source:
+
+    def __init__(self, dev):
+        # dev may get wrapped later, see Publisher and Debouncer
+        self.name = dev.dev
+        self.dev = dev
+        self.pending = []
+
+
+def _frames(source, events):
+    chunk = []
+    for e in events:
+        chunk.append(e)
+        if e[2] == EV.SYN and e[3] == SYN.REPORT:
+            yield e[0], e[1], source, chunk
+            chunk = []
+    if chunk:
+        e = chunk[-1]
+        yield e[0], e[1], source, chunk
+
+# Reads all sources through one epoll set, which also carries the timers
+# and control fds given as handlers.  Frames from different sources that
+# arrive in the same wakeup are handed out in kernel timestamp order, each
+# kept whole.  read() returns None once a handler returns False.  While
+# paused, events are read and thrown away.
+class Reader:
+
+    def __init__(self, sources, timers, handlers=(), stamped=False):
+        self.sources = sources
+        self.single = sources[0] if len(sources) == 1 and not handlers else None
+        self.fast = False
+        self.stamped = stamped
+        self.stamp = None
+        self.paused = False
+        self.events = 0
+        self.by_fd = {s.dev.fileno(): s for s in sources}
+        self.handlers = {f.fileno(): callback for f, callback in (*timers, *handlers)}
+        self.poll = select.epoll()
+        for s in sources:
+            self.poll.register(s.dev, select.EPOLLIN)
+        for fd in self.handlers:
+            self.poll.register(fd, select.EPOLLIN)
+
+    # a lone source with no timers armed is read with a plain blocking read
+    def configure(self, cfg):
+        self.fast = self.single is not None and not cfg.timed and cfg.output_period is None
+
+    def read(self):
+        if self.fast:
+            events = self.single.dev.read()
+            self.events += length_hint(events)
+            if self.stamped:
+                self.stamp = monotonic_ns()
+            return ((self.single, events),)
+
+        batches = []
+        for fd, _ in self.poll.poll():
+            source = self.by_fd.get(fd, None)
+            if source is None:
+                if self.handlers[fd]() is False:
+                    return None
+            else:
+                events = source.dev.read()
+                self.events += length_hint(events)
+                if not self.paused:
+                    batches.append((source, events))
+
+        if self.stamped:
+            self.stamp = monotonic_ns()
+        if len(batches) > 1:
+            frames = [f for source, events in batches for f in _frames(source, events)]
+            frames.sort(key=lambda f: (f[0], f[1]))
+            batches = [(source, chunk) for _, _, source, chunk in frames]
+        return batches
+
+def _configure(cfg, sink, limiter, machine, reader):
+    if cfg.output_period is None:
+        if limiter.merged:
+            limiter.flush(monotonic_ns())
+        out = sink
+    else:
+        limiter.period = cfg.output_period
+        out = limiter
+    machine.ring = out
+    machine.configure(cfg)
+    reader.configure(cfg)
+    return out
+
+# Keys held down across a table swap whose entry changed are let go now,
+# as the old table would on their release: the new one would not undo what
+# their press did.  Keys with unchanged entries stay down.  Returns the
+# modifier mask without modifiers that are gone.
+def _rebind(sources, old, new, machine, mod, out):
+    down = 0
+    for s in sources:
+        down |= int.from_bytes(s.dev.get_key(), 'little')
+    frame = []
+    for code in _bits(down):
+        i = (EV.KEY << 10) | code
+        action = old[i]
+        if action is None or action == new[i]:
+            continue
+        kind = action[0]
+        if kind == MAP:
+            frame.append((action[1], action[2], 0))
+        elif kind == MOD:
+            mod &= ~action[1]
+        elif kind >= HOLDMAP and (new[i] is None or new[i][0] < HOLDMAP):
+            # the machine remembers what the press did, unless the release
+            # no longer reaches it
+            machine.handle(i, action, 0, frame)
+    if frame:
+        frame.append(SYN_REPORT)
+        out.put(frame)
+    machine.mod = mod
+    return mod
+
+def pump(sources, sink, watcher, handlers=(), stamped=False, commands=None, hooks=None):
+    cfg = watcher.cfg
+    limiter = Limiter(sink)
+    machine = Machine(cfg, sink)
+    reader = Reader(sources, ((machine.timer, machine.timeout), (limiter.timer, limiter.timeout)), handlers, stamped)
+    if commands is not None:
+        commands.attach(reader, machine, limiter)
+    out = _configure(cfg, sink, limiter, machine, reader)
+    mod = 0
+
+    while True:
+        batches = reader.read()
+        if batches is None:
+            return
+        if hooks is not None:
+            hooks.on_read_batch(batches)
+        table = machine.table
+        busy = machine.busy
+
+        for source, events in batches:
+            pending = source.pending
+
+            for sec, usec, type, code, value in events:
+                i = (type << 10) | code
+                if busy and value == 1 and type == EV.KEY:
+                    consumed = machine.interrupt(i, pending)
+                    table = machine.table
+                    busy = machine.busy
+                    if consumed:
                         continue
 
-                    code = event.code
-                    value = event.value
-                    
-                    key = KEYMAP.get(code, None)
-                    if key is not None:
-                        pending_key.append((key, value))
+                action = table[i]
+                if action is None:
+                    continue
+
+                kind = action[0]
+                if kind == MAP:
+                    pending.append((action[1], action[2], value))
+                elif kind == AXIS:
+                    _, type, code, lut, lo, hi, shift = action
+                    value = lo if value < lo else hi if value > hi else value
+                    pending.append((type, code, lut[(value - lo) >> shift]))
+                elif kind == SYNC:
+                    if value != 0:
                         continue
-                    m = MODIFIERS.get(code, None)
-                    if m:
-                        if value:
-                            mod |= m
+                    if pending:
+                        pending.append(SYN_REPORT)
+                        if hooks is not None:
+                            hooks.on_frame(pending)
+                        # a full ring counts as an overflow, see ctl stats
+                        if stamped:
+                            out.put(pending, [sec * 1000000000 + usec * 1000, reader.stamp, monotonic_ns()])
                         else:
-                            mod &= (MASK ^ m)
-                        print(mod)
-                        continue
-                    if value != 1:
-                        continue
-                    if code == KEY.KEY_ESC:
-                        break
-                    elif code == KEY.KEY_BACKSPACE:
-                        result = reload(config)
-                        if result:
-                            NAME, EVENTS, PROPS, KEYMAP, MODIFIERS, MASK, COMBO = result
-                            print(datetime.now(), "reload success")
-                        continue
+                            out.put(pending)
+                        pending = []
+                    if busy:
+                        machine.synced()
+                        busy = machine.busy
+                    if watcher.cfg is not cfg:
+                        cfg = watcher.cfg
+                        old = table
+                        out = _configure(cfg, sink, limiter, machine, reader)
+                        table = machine.table
+                        mod = _rebind(sources, old, table, machine, mod, out)
+                elif kind == MOD:
+                    if value:
+                        mod |= action[1]
+                    else:
+                        mod &= ~action[1]
+                    machine.mod = mod
+                elif kind >= HOLDMAP:
+                    machine.handle(i, action, value, pending)
+                    table = machine.table
+                    busy = machine.busy
+                elif value != 1:
+                    continue
+                elif kind == COMBO:
+                    macro = action[1].get(mod, None)
+                    if macro is not None:
+                        out.put(macro)
+                elif kind == QUIT:
+                    return
+                elif kind == RELOAD:
+                    watcher.request()
+
+            source.pending = pending
+
+# REPEAT = True takes the rate of the first source that autorepeats
+def repeat_rate(repeat, sources):
+    if repeat is not True:
+        return repeat
+    for s in sources:
+        if EV.REP in s.dev.capabilities.get(EV, ()):
+            return tuple(s.dev.get_rep())
+    return REPEAT_DELAY, REPEAT_PERIOD
+
+# loopback runs against in-process devices, see loopback.py
+def main(config, devices=(), engine='thread', stats=None, control=None, loopback=False, profile=False,
+         realtime=None, policy='fifo', cpus=None, offload=False, state=None):
+    source_device, output_device = (LoopbackDevice, LoopbackOutput) if loopback else (EventDevice, UInputDevice)
+    cfg = reload(config)
+    devices = devices or cfg.sources
+    assert devices, "no source devices"
+
+    if realtime is not None:
+        for step, e in enable_realtime(realtime, policy, cpus):
+            print(datetime.now(), "realtime:", step, "failed:", e)
+    elif cpus:
+        os.sched_setaffinity(0, cpus)
+
+    with ExitStack() as stack:
+        sources = [Source(stack.enter_context(source_device(device))) for device in devices]
+        if offload and offload_keymap(config, cfg, [s.dev for s in sources]):
+            return
+
+        for s in sources:
+            stack.enter_context(grab(s.dev))
+            if stats is not None:
+                s.dev.set_clock_id(c_int(CLOCK_MONOTONIC))
+            if state is not None:
+                s.dev = stack.enter_context(Publisher(s.dev, os.path.join(state, f"{s.name}.state")))
+            if cfg.debounce:
+                s.dev = stack.enter_context(Debouncer(s.dev, cfg.debounce, cfg.debounce_mode))
+
+        absinfo = {}
+        for _, src, _ in cfg.abs_axes():
+            dev = next((s.dev for s in sources if src in s.dev.capabilities.get(ABS, ())), sources[0].dev)
+            absinfo[src] = dev.get_abs(src)
+        cfg.bind(absinfo)
+        watcher = Watcher(config, cfg, absinfo).spawn()
+
+        devices = [stack.enter_context(output_device(name.encode(), events, props, abs))
+                   for (name, events, props), abs in zip(cfg.outputs, cfg.absinfo)]
+        latency = None if stats is None else Stats().spawn(stats)
+        output = Outputs(devices)
+        repeater = None
+        if cfg.repeat:
+            repeater = output = Repeater(output, *repeat_rate(cfg.repeat, sources))
+        scheduler = MacroScheduler(output)
+        hooks = None
+        if profile:
+            hooks = Profiler()
+            signal.signal(signal.SIGUSR1, lambda signum, frame: hooks.dump())
+            stack.callback(signal.signal, signal.SIGUSR1, signal.SIG_DFL)
+        direct = Direct(output, scheduler, latency, hooks)
+
+        handlers = []
+        if repeater is not None:
+            handlers.append((repeater.timer, repeater.timeout))
+        emitter = None
+        if engine == 'epoll':
+            sink = direct
+            signals = stack.enter_context(Control(watcher))
+            handlers += (scheduler.timer, scheduler.timeout), (signals, signals.handle)
+        else:
+            sink = FrameRing()
+            scheduler.spawn()
+            emitter = Emitter(sink, direct)
+
+        commands = None
+        if control is not None:
+            commands = Commands(watcher, sources, sink, scheduler, latency, hooks)
+            stack.callback(commands.do_resume)
+            server = stack.enter_context(Server(control, commands))
+            handlers.append((server, server.handle))
 
-                    combo = COMBO.get(mod, {}).get(code, None)
-                    if combo:
-                        queue.put(combo)
+        try:
+            pump(sources, sink, watcher, handlers, latency is not None, commands, hooks)
+        finally:
+            # drained before the outputs close
+            if emitter is not None:
+                emitter.stop()
+            scheduler.stop()
 
+    print(sink.stats())
+    print(scheduler.stats())
+    if latency is not None:
+        latency.dump()
+    if hooks is not None:
+        hooks.dump()
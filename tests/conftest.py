@@ -0,0 +1,113 @@
+import os
+import select
+import threading
+from time import monotonic, sleep
+
+import pytest
+
+from inputct import virtual
+from inputct.evdev import EV, SYN, KEY, input_event_struct
+from inputct.loopback import LoopbackOutput, LoopbackDevice, nodes
+
+NAME = 'inputct test'
+# a read that stays empty this long means the pipeline has settled
+QUIET = 0.05
+TIMEOUT = 5
+
+
+def wait_for(check, timeout=TIMEOUT):
+    deadline = monotonic() + timeout
+    while not check():
+        assert monotonic() < deadline, "timed out"
+        sleep(0.005)
+
+
+def node(name):
+    return next((dev for dev, n in list(nodes.items()) if n.name == name), None)
+
+
+# Frames read from a loopback node, without their SYN_REPORT
+class Reader:
+
+    def __init__(self, dev):
+        self.dev = LoopbackDevice(dev)
+        self.dev.open()
+
+    def close(self):
+        self.dev.close()
+
+    def frames(self, quiet=QUIET):
+        frames = []
+        frame = []
+        while select.select([self.dev], [], [], quiet)[0]:
+            for _, _, type, code, value in self.dev.read(256):
+                if type == EV.SYN and code == SYN.REPORT:
+                    frames.append(frame)
+                    frame = []
+                else:
+                    frame.append((type, code, value))
+        assert not frame, "partial frame"
+        return frames
+
+    def keys(self, quiet=QUIET):
+        return [[(KEY(code), value) for type, code, value in frame if type == EV.KEY]
+                for frame in self.frames(quiet)]
+
+
+# virtual.main over loopback devices.  main needs the main thread for its
+# signal handling, so the test body runs on a thread of its own and ESC,
+# the default QUIT key, ends main once it is done.
+class Virtual:
+
+    def __init__(self, tmp_path, config, events, engine='thread', control=False, abs=(), **kwargs):
+        self.path = tmp_path / 'config.py'
+        self.write(config)
+        self.control = str(tmp_path / 'control.sock') if control else None
+        self.engine = engine
+        self.kwargs = kwargs
+        self.source = LoopbackOutput(b'test source', [*events, KEY.KEY_ESC], abs=abs)
+        self.output = None
+
+    def write(self, config):
+        # replaced whole, so the watcher never reads half a file
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(f"NAME={NAME!r}\n" + config)
+        os.rename(tmp, self.path)
+
+    def send(self, *events):
+        self.source.write([(EV.KEY, code, value) for code, value in events] + [(EV.SYN, SYN.REPORT, 0)])
+
+    def run(self, body):
+        failure = []
+
+        def drive():
+            try:
+                wait_for(lambda: node(NAME) is not None)
+                if self.control is not None:
+                    wait_for(lambda: os.path.exists(self.control))
+                self.output = Reader(node(NAME))
+                body(self)
+            except BaseException as e:
+                failure.append(e)
+            finally:
+                self.send((KEY.KEY_ESC, 1))
+
+        thread = threading.Thread(target=drive, daemon=True)
+        thread.start()
+        try:
+            virtual.main(str(self.path), [self.source.dev], self.engine, control=self.control,
+                         loopback=True, **self.kwargs)
+        finally:
+            thread.join(TIMEOUT)
+            if self.output is not None:
+                self.output.close()
+            self.source.close()
+        if failure:
+            raise failure[0]
+
+
+@pytest.fixture
+def run_virtual(tmp_path):
+    def run(config, events, body, **kwargs):
+        Virtual(tmp_path, config, events, **kwargs).run(body)
+    return run
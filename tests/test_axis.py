@@ -0,0 +1,69 @@
+import pytest
+
+from inputct.axis import compile_axis, LUT_BITS
+from inputct.evdev import input_absinfo
+
+
+def info(minimum=-100, maximum=100, value=0, fuzz=0, flat=0, resolution=0):
+    return input_absinfo(value, minimum, maximum, fuzz, flat, resolution)
+
+
+# what the reader does with an AXIS action
+def apply(axis, value):
+    lut, lo, hi, shift, _ = axis
+    value = lo if value < lo else hi if value > hi else value
+    return lut[(value - lo) >> shift]
+
+
+def test_identity():
+    axis = compile_axis(info(value=7, fuzz=4, flat=8, resolution=2))
+    lut, lo, hi, shift, out = axis
+    assert (lo, hi, shift) == (-100, 100, 0)
+    assert lut == list(range(-100, 101))
+    assert (out.value, out.minimum, out.maximum, out.fuzz, out.flat, out.resolution) == (7, -100, 100, 4, 8, 2)
+    assert apply(axis, 1000) == 100
+
+
+def test_deadzone():
+    axis = compile_axis(info(flat=8), deadzone=0.1)
+    assert [apply(axis, v) for v in (-10, -5, 0, 5, 10)] == [0] * 5
+    assert [apply(axis, v) for v in (-100, -55, 55, 100)] == [-100, -50, 50, 100]
+    # the deadzone replaces the flat of the source
+    assert axis[4].flat == 0
+
+
+@pytest.mark.parametrize('spec, expected', [
+    (dict(invert=True), [100, 30, 0, -30, -100]),
+    (dict(curve=2), [-100, -9, 0, 9, 100]),
+    (dict(curve=2, invert=True), [100, 9, 0, -9, -100]),
+])
+def test_shape(spec, expected):
+    axis = compile_axis(info(), **spec)
+    assert [apply(axis, v) for v in (-100, -30, 0, 30, 100)] == expected
+
+
+def test_calibrate():
+    axis = compile_axis(info(0, 100), calibrate=(10, 60, 100))
+    assert [apply(axis, v) for v in (0, 10, 35, 60, 80, 100)] == [0, 0, 25, 50, 75, 100]
+
+
+def test_range():
+    axis = compile_axis(info(value=100, fuzz=4, flat=8, resolution=2), range=(0, 255))
+    out = axis[4]
+    assert [apply(axis, v) for v in (-100, 0, 100)] == [0, 128, 255]
+    assert (out.value, out.minimum, out.maximum) == (255, 0, 255)
+    # scaled by 255 / 200
+    assert (out.fuzz, out.flat, out.resolution) == (5, 10, 3)
+
+
+# a source range wider than the table is quantised, the ends still reach
+# the ends of the output
+def test_quantise():
+    axis = compile_axis(info(0, (1 << 20) - 1, 1 << 19), range=(0, 1023))
+    lut, lo, hi, shift, out = axis
+    assert shift == 20 - LUT_BITS
+    assert len(lut) == 1 << LUT_BITS
+    assert apply(axis, 0) == 0
+    assert apply(axis, hi) == 1023
+    assert apply(axis, 1 << 19) == 512
+    assert out.value == 512
@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from inputct.bridge import Sender, Receiver
+from inputct.evdev import EV, KEY, REL
+from inputct.loopback import LoopbackOutput, LoopbackDevice, nodes
+from inputct.remap import SYN_REPORT
+
+from conftest import Reader, node, wait_for
+
+# Sender and Receiver loops only end with their sockets or devices closed
+# under them, which is an error while the test runs but not after
+class Loop:
+
+    def __init__(self, run):
+        self.done = False
+        threading.Thread(target=self.run, args=(run,), daemon=True).start()
+
+    def run(self, run):
+        try:
+            run()
+        except Exception:
+            if not self.done:
+                raise
+
+
+@pytest.fixture(params=['tcp', 'udp'])
+def bridge(request):
+    udp = request.param == 'udp'
+    with LoopbackOutput(b'bridge source', [KEY.KEY_A, KEY.KEY_B, REL.X]) as source:
+        # held before the sender starts, the mirror must still see it down
+        source.write([(EV.KEY, KEY.KEY_B, 1), SYN_REPORT])
+        # the mirror name as given on the command line, a str
+        with LoopbackDevice(source.dev) as dev, \
+             Receiver(('127.0.0.1', 0), 'bridge mirror', udp, 0.05, LoopbackOutput) as receiver:
+            loops = [Loop(receiver.run)]
+            sender = Sender(dev, receiver.address, udp, 0.05)
+            loops.append(Loop(sender.run))
+            wait_for(lambda: node('bridge mirror') is not None)
+            mirror = Reader(node('bridge mirror'))
+            try:
+                yield source, sender, receiver, mirror
+            finally:
+                for loop in loops:
+                    loop.done = True
+                mirror.close()
+                sender.close()
+
+
+def test_frames(bridge):
+    source, sender, receiver, mirror = bridge
+    wait_for(lambda: nodes[mirror.dev.dev].keys == 1 << KEY.KEY_B)
+    mirror.frames()
+    expected = []
+    for i in range(5):
+        source.write([(EV.KEY, KEY.KEY_A, 1), (EV.REL, REL.X, i), SYN_REPORT])
+        source.write([(EV.KEY, KEY.KEY_A, 0), SYN_REPORT])
+        expected += [[(EV.KEY, KEY.KEY_A, 1), (EV.REL, REL.X, i)], [(EV.KEY, KEY.KEY_A, 0)]]
+    assert mirror.frames() == expected
+    assert receiver.lost == receiver.late == 0
+
+
+# a key the mirror thinks is down but the source does not, as after a lost
+# release, is let go by the next STATE
+def test_resync(bridge):
+    source, sender, receiver, mirror = bridge
+    wait_for(lambda: nodes[mirror.dev.dev].keys == 1 << KEY.KEY_B)
+    mirror.frames()
+    receiver.mirror.write([(EV.KEY, KEY.KEY_A, 1), SYN_REPORT])
+    if receiver.udp:
+        wait_for(lambda: nodes[mirror.dev.dev].keys == 1 << KEY.KEY_B)
+        assert mirror.frames() == [[(EV.KEY, KEY.KEY_A, 1)], [(EV.KEY, KEY.KEY_A, 0)]]
+    else:
+        # no STATE after connect over TCP, but a closed connection lets go
+        # of everything
+        sender.close()
+        wait_for(lambda: receiver.mirror is None)
+        assert mirror.frames() == [[(EV.KEY, KEY.KEY_A, 1)], [(EV.KEY, KEY.KEY_A, 0), (EV.KEY, KEY.KEY_B, 0)]]
@@ -0,0 +1,87 @@
+import os
+import json
+
+import pytest
+
+from inputct.capture import Capture, CaptureWriter, describe, output_args, replay
+from inputct.evdev import EV, SYN, KEY, ABS, input_event_struct, input_absinfo
+from inputct.loopback import LoopbackOutput, LoopbackDevice
+
+from conftest import Reader
+
+
+def records(frames, start=1000000, interval=1000):
+    data = bytearray()
+    for i, frame in enumerate(frames):
+        sec, usec = divmod(start + i * interval, 1000000)
+        for type, code, value in (*frame, (EV.SYN, SYN.REPORT, 0)):
+            data += input_event_struct.pack(sec, usec, type, code, value)
+    return bytes(data)
+
+
+@pytest.fixture
+def source():
+    abs = [(ABS.X, input_absinfo(0, -100, 100, 0, 0, 0))]
+    with LoopbackOutput(b'capture source', [KEY.KEY_A, KEY.KEY_B, ABS.X], abs=abs) as out:
+        with LoopbackDevice(out.dev) as dev:
+            yield dev
+
+
+FRAMES = [[(EV.KEY, KEY.KEY_A, i & 1), (EV.ABS, ABS.X, i % 100)] for i in range(1000)]
+
+
+@pytest.mark.parametrize('codec', ['none', 'zlib', 'lzma'])
+def test_round_trip(tmp_path, source, codec):
+    data = records(FRAMES)
+    path = tmp_path / 'capture'
+    with CaptureWriter(path, describe(source), codec, chunk=500) as w:
+        for i in range(0, len(data), 4096):
+            w.write(data[i:i+4096])
+
+    c = Capture(path)
+    assert json.loads(json.dumps(describe(source))) == c.description
+    assert len(c) == len(data) // input_event_struct.size
+    assert len(c.index) > 1
+    assert bytes(c.read()) == data
+
+    # a range cut out of the middle, across chunks
+    start, end = c.offset(0.1), c.offset(0.5)
+    expected = b''.join(input_event_struct.pack(sec, usec, *rest)
+                        for sec, usec, *rest in input_event_struct.iter_unpack(data)
+                        if start <= sec * 1000000 + usec < end)
+    assert bytes(c.read(start, end)) == expected
+
+
+def test_truncated(tmp_path, source):
+    data = records(FRAMES)
+    path = tmp_path / 'capture'
+    with CaptureWriter(path, describe(source), 'zlib', chunk=500) as w:
+        w.write(data)
+    size = os.path.getsize(path)
+    # the trailer and index are gone, and half of the last chunk
+    index = Capture(path).index
+    last = index[-1]
+    with open(path, 'r+b') as f:
+        f.truncate(last[0] + last[1] // 2)
+    assert os.path.getsize(path) < size
+
+    c = Capture(path)
+    assert c.index == index[:-1]
+    assert bytes(c.read()) == data[:sum(e[2] for e in c.index) * input_event_struct.size]
+
+
+def test_replay(tmp_path, source):
+    path = tmp_path / 'capture'
+    with CaptureWriter(path, describe(source)) as w:
+        w.write(records(FRAMES[:10]))
+
+    c = Capture(path)
+    with LoopbackOutput(*output_args(c.description)) as out:
+        assert out.node.name == 'capture source'
+        assert out.node.absinfo[ABS.X].minimum == -100
+        reader = Reader(out.dev)
+        try:
+            replay(c, out, speed=0)
+            assert reader.frames() == FRAMES[:10]
+        finally:
+            reader.close()
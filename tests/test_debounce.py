@@ -0,0 +1,71 @@
+import select
+from time import sleep
+
+import pytest
+
+from inputct.debounce import Debouncer
+from inputct.evdev import EV, KEY
+from inputct.loopback import LoopbackOutput, LoopbackDevice
+from inputct.remap import SYN_REPORT
+
+from conftest import QUIET
+
+WINDOW = 50
+
+
+@pytest.fixture
+def source():
+    with LoopbackOutput(b'debounce source', [KEY.KEY_A]) as out:
+        with LoopbackDevice(out.dev) as dev:
+            yield out, dev
+
+
+def send(out, *values):
+    for value in values:
+        out.write([(EV.KEY, KEY.KEY_A, value), SYN_REPORT])
+
+
+# key values that came out, settled ones included once their timer is due
+def values(debouncer, quiet=WINDOW / 1000 + QUIET):
+    result = []
+    while select.select([debouncer], [], [], quiet)[0]:
+        result += [value for _, _, type, code, value in debouncer.read() if type == EV.KEY]
+    return result
+
+
+@pytest.mark.parametrize('mode', ['eager', 'deferred'])
+def test_chatter(source, mode):
+    out, dev = source
+    with Debouncer(dev, WINDOW, mode) as debouncer:
+        send(out, 1, 0, 1, 0)
+        assert values(debouncer) == [1, 0]
+        assert debouncer.suppressed == 3
+        assert out.node.keys == 0
+
+
+# a release after the key was held for longer than the window
+@pytest.mark.parametrize('mode, now, settled, suppressed', [('eager', [0], [], 0), ('deferred', [], [0], 1)])
+def test_release(source, mode, now, settled, suppressed):
+    out, dev = source
+    with Debouncer(dev, WINDOW, mode) as debouncer:
+        send(out, 1)
+        assert values(debouncer, 0) == [1]
+        sleep(WINDOW / 1000)
+        send(out, 0)
+        # eager lets it go at once, deferred once it stayed up
+        assert values(debouncer, 0) == now
+        assert values(debouncer) == settled
+        assert debouncer.suppressed == suppressed
+
+
+# a press soon after a release: eager holds it back until it settled,
+# deferred takes the held release back and nothing comes out
+@pytest.mark.parametrize('mode, expected', [('eager', [0, 1]), ('deferred', [])])
+def test_bounce(source, mode, expected):
+    out, dev = source
+    send(out, 1)
+    with Debouncer(dev, WINDOW, mode) as debouncer:
+        # held before the filter started, so it counts as settled
+        send(out, 0, 1)
+        assert values(debouncer) == expected
+        assert debouncer.emitted[KEY.KEY_A] == 1
@@ -0,0 +1,103 @@
+import select
+import threading
+
+from inputct.ring import FrameRing, Limiter
+from inputct.evdev import EV, SYN, KEY, REL, ABS
+
+from conftest import TIMEOUT
+
+SYN_REPORT = (EV.SYN, SYN.REPORT, 0)
+
+
+def key(code, value):
+    return [(EV.KEY, code, value), SYN_REPORT]
+
+def rel(value):
+    return [(EV.REL, REL.X, value), SYN_REPORT]
+
+def pos(value):
+    return [(EV.ABS, ABS.X, value), SYN_REPORT]
+
+def drain(ring):
+    items = []
+    while len(ring):
+        items.append(ring.get())
+    return items
+
+
+def test_keys_kept():
+    ring = FrameRing(16)
+    frames = [key(KEY.KEY_A, 1), key(KEY.KEY_A, 0), key(KEY.KEY_A, 1), key(KEY.KEY_A, 0)]
+    for frame in frames:
+        ring.put(frame)
+    assert drain(ring) == frames
+    assert ring.coalesced == ring.dropped == 0
+
+
+def test_motion_folded():
+    ring = FrameRing(16)
+    for i in range(1, 4):
+        ring.put(rel(i))
+        ring.put(pos(i * 10))
+    ring.put(key(KEY.KEY_A, 1))
+    ring.put(rel(5))
+    # a consumer that fell behind gets one frame per run of motion, never
+    # across the key frame
+    assert drain(ring) == [[(EV.REL, REL.X, 6), (EV.ABS, ABS.X, 30), SYN_REPORT],
+                           key(KEY.KEY_A, 1), rel(5)]
+    assert ring.coalesced == 5
+    assert ring.dropped == 2
+
+
+def test_slots_kept():
+    ring = FrameRing(16)
+    frames = [[(EV.ABS, ABS.MT_SLOT, i), (EV.ABS, ABS.MT_POSITION_X, i), SYN_REPORT] for i in range(2)]
+    for frame in frames:
+        ring.put(frame)
+    assert drain(ring) == frames
+
+
+def test_full_blocks():
+    ring = FrameRing(2)
+    assert ring.put(key(KEY.KEY_A, 1))
+    assert ring.put(key(KEY.KEY_A, 0))
+    result = []
+    writer = threading.Thread(target=lambda: result.append(ring.put(key(KEY.KEY_B, 1))))
+    writer.start()
+    writer.join(0.05)
+    assert writer.is_alive()
+    assert ring.overflows == 1
+
+    assert ring.get() == key(KEY.KEY_A, 1)
+    writer.join(TIMEOUT)
+    assert result == [False]
+    assert drain(ring) == [key(KEY.KEY_A, 0), key(KEY.KEY_B, 1)]
+    assert ring.stats() == dict(pushed=3, pending=0, overflows=1, coalesced=0, dropped=0)
+
+
+def test_limiter_key_flushes():
+    ring = FrameRing(16)
+    limiter = Limiter(ring, 10 * 1000000000)
+    limiter.put(rel(1))
+    limiter.put(rel(2))
+    limiter.put(rel(3))
+    assert drain(ring) == [rel(1)]
+    # the held motion goes out before the key, and its timer is disarmed
+    limiter.put(key(KEY.KEY_A, 1))
+    assert not limiter.armed
+    assert drain(ring) == [rel(5), key(KEY.KEY_A, 1)]
+    assert limiter.stats() == dict(coalesced=1, dropped=0)
+
+
+def test_limiter_timer():
+    ring = FrameRing(16)
+    limiter = Limiter(ring, 20 * 1000000)
+    limiter.put(pos(1))
+    limiter.put(pos(2))
+    limiter.put(pos(3))
+    assert drain(ring) == [pos(1)]
+    assert limiter.armed
+    assert select.select([limiter.timer], [], [], TIMEOUT)[0]
+    limiter.timeout()
+    assert drain(ring) == [pos(3)]
+    assert limiter.stats() == dict(coalesced=1, dropped=1)
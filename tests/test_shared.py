@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from inputct.shared import Publisher, SharedState
+from inputct.evdev import EV, KEY, ABS, input_absinfo
+from inputct.loopback import LoopbackOutput, LoopbackDevice
+from inputct.remap import SYN_REPORT
+
+
+@pytest.fixture
+def source():
+    abs = [(ABS.X, input_absinfo(7, -100, 100, 0, 0, 0))]
+    with LoopbackOutput(b'shared source', [KEY.KEY_A, KEY.KEY_B, ABS.X], abs=abs) as out:
+        # held before publishing starts
+        out.write([(EV.KEY, KEY.KEY_B, 1), SYN_REPORT])
+        with LoopbackDevice(out.dev) as dev:
+            yield out, dev
+
+
+def test_publish(tmp_path, source):
+    out, dev = source
+    path = str(tmp_path / 'source.state')
+    with Publisher(dev, path) as publisher, SharedState(path) as state:
+        frames, time, keys, axes = state.snapshot()
+        assert (frames, time, keys) == (0, 0, 1 << KEY.KEY_B)
+        assert axes[ABS.X] == 7 and axes.count(0) == len(axes) - 1
+
+        out.write([(EV.KEY, KEY.KEY_A, 1), (EV.ABS, ABS.X, -42), SYN_REPORT])
+        events = list(publisher.read())
+        assert [e[2:] for e in events] == [(EV.KEY, KEY.KEY_A, 1), (EV.ABS, ABS.X, -42), SYN_REPORT]
+        frames, time, keys, axes = state.snapshot()
+        assert frames == 1
+        assert time == events[-1][0] * 1000000 + events[-1][1]
+        assert keys == 1 << KEY.KEY_A | 1 << KEY.KEY_B
+        assert state.key(KEY.KEY_A) and state.key(KEY.KEY_B)
+        assert state.axis(ABS.X) == axes[ABS.X] == -42
+
+        # half a frame is not published
+        out.write([(EV.KEY, KEY.KEY_A, 0)])
+        list(publisher.read())
+        assert state.key(KEY.KEY_A)
+        out.write([SYN_REPORT])
+        list(publisher.read())
+        assert not state.key(KEY.KEY_A)
+        assert state.snapshot()[0] == 2
+    assert not os.path.exists(path)
+
+
+# after SYN_DROPPED the events up to the next SYN_REPORT are skipped and
+# the state is read back from the device instead
+def test_dropped(tmp_path, source):
+    out, dev = source
+    path = str(tmp_path / 'source.state')
+    with Publisher(dev, path) as publisher, SharedState(path) as state:
+        dev.overflow = True
+        out.write([(EV.KEY, KEY.KEY_B, 0), (EV.KEY, KEY.KEY_A, 1), (EV.ABS, ABS.X, 3), SYN_REPORT])
+        list(publisher.read())
+        assert not publisher.dropped
+        assert state.snapshot()[2] == 1 << KEY.KEY_A
+        assert state.axis(ABS.X) == 3
+
+
+def test_not_a_block(tmp_path):
+    path = tmp_path / 'other'
+    path.write_bytes(bytes(1024))
+    with pytest.raises(AssertionError):
+        SharedState(str(path))
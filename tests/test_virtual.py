@@ -0,0 +1,283 @@
+from time import sleep
+
+import pytest
+
+from inputct import virtual
+from inputct.control import request
+from inputct.evdev import EV, SYN, KEY, ABS, input_absinfo
+
+from conftest import NAME, Reader, node, wait_for
+
+K = KEY
+
+
+@pytest.mark.parametrize('engine', ['thread', 'epoll'])
+def test_remap(run_virtual, engine):
+    config = "EVENTS=[KEY_A, KEY_B]\nKEYMAP={KEY_A: KEY_B, KEY_B: KEY_A}\n"
+
+    def body(v):
+        v.send((K.KEY_A, 1))
+        v.send((K.KEY_A, 0))
+        v.send((K.KEY_B, 1), (K.KEY_C, 1))
+        v.send((K.KEY_B, 0), (K.KEY_C, 0))
+        assert v.output.keys() == [[(K.KEY_B, 1)], [(K.KEY_B, 0)], [(K.KEY_A, 1)], [(K.KEY_A, 0)]]
+
+    run_virtual(config, [K.KEY_A, K.KEY_B, K.KEY_C], body, engine=engine)
+
+
+def test_layers(run_virtual):
+    config = ("EVENTS=[KEY_H, KEY_LEFT, KEY_SPACE]\nKEYMAP={KEY_H: KEY_H}\n"
+              "TAPHOLD={KEY_SPACE: (KEY_SPACE, 'nav')}\nLAYERS={'nav': {KEY_H: KEY_LEFT}}\n")
+
+    def body(v):
+        v.send((K.KEY_SPACE, 1))
+        v.send((K.KEY_H, 1))
+        assert v.output.keys() == [[(K.KEY_LEFT, 1)]]
+        # released after the layer is gone, still on the key it pressed
+        v.send((K.KEY_SPACE, 0))
+        v.send((K.KEY_H, 0))
+        assert v.output.keys() == [[(K.KEY_LEFT, 0)]]
+        v.send((K.KEY_H, 1))
+        v.send((K.KEY_H, 0))
+        assert v.output.keys() == [[(K.KEY_H, 1)], [(K.KEY_H, 0)]]
+
+    run_virtual(config, [K.KEY_H, K.KEY_SPACE], body)
+
+
+def test_taphold(run_virtual):
+    config = ("EVENTS=[KEY_A, KEY_Z, KEY_LEFTCTRL]\nKEYMAP={KEY_A: KEY_A}\n"
+              "TAPHOLD={KEY_CAPSLOCK: (KEY_Z, KEY_LEFTCTRL)}\nTAP_TIMEOUT=100\n")
+
+    def body(v):
+        v.send((K.KEY_CAPSLOCK, 1))
+        v.send((K.KEY_CAPSLOCK, 0))
+        assert v.output.keys() == [[(K.KEY_Z, 1)], [(K.KEY_Z, 0)]]
+
+        # held past the timeout
+        v.send((K.KEY_CAPSLOCK, 1))
+        sleep(0.15)
+        v.send((K.KEY_CAPSLOCK, 0))
+        assert v.output.keys() == [[(K.KEY_LEFTCTRL, 1)], [(K.KEY_LEFTCTRL, 0)]]
+
+        # another key pressed while it is down decides for hold
+        v.send((K.KEY_CAPSLOCK, 1))
+        v.send((K.KEY_A, 1))
+        v.send((K.KEY_A, 0))
+        v.send((K.KEY_CAPSLOCK, 0))
+        keys = [e for frame in v.output.keys() for e in frame]
+        assert keys == [(K.KEY_LEFTCTRL, 1), (K.KEY_A, 1), (K.KEY_A, 0), (K.KEY_LEFTCTRL, 0)]
+
+    run_virtual(config, [K.KEY_A, K.KEY_CAPSLOCK], body)
+
+
+def test_chords(run_virtual):
+    config = ("EVENTS=[KEY_J, KEY_K, KEY_Z]\nKEYMAP={KEY_J: KEY_J, KEY_K: KEY_K}\n"
+              "CHORDS={(KEY_J, KEY_K): KEY_Z}\nCHORD_TIMEOUT=30\n")
+
+    def body(v):
+        v.send((K.KEY_J, 1))
+        v.send((K.KEY_K, 1))
+        v.send((K.KEY_J, 0))
+        v.send((K.KEY_K, 0))
+        keys = [e for frame in v.output.keys() for e in frame]
+        assert keys == [(K.KEY_Z, 1), (K.KEY_Z, 0)]
+
+        # alone, past the timeout, it is the key itself
+        v.send((K.KEY_J, 1))
+        sleep(0.06)
+        v.send((K.KEY_J, 0))
+        keys = [e for frame in v.output.keys() for e in frame]
+        assert keys == [(K.KEY_J, 1), (K.KEY_J, 0)]
+
+    run_virtual(config, [K.KEY_J, K.KEY_K], body)
+
+
+def test_combo(run_virtual):
+    config = ("EVENTS=[KEY_A]\nMODIFIERS=[KEY_LEFTCTRL]\nKEYMAP={}\n"
+              "COMBO={(KEY_LEFTCTRL,): {KEY_Q: [(KEY_A, 1), (SYN.REPORT, 0), 1000000, (KEY_A, 0), (SYN.REPORT, 0)]}}\n")
+
+    def body(v):
+        v.send((K.KEY_LEFTCTRL, 1))
+        v.send((K.KEY_Q, 1))
+        v.send((K.KEY_Q, 0))
+        v.send((K.KEY_LEFTCTRL, 0))
+        assert v.output.keys() == [[(K.KEY_A, 1)], [(K.KEY_A, 0)]]
+
+        # without the modifier there is no macro for it
+        v.send((K.KEY_Q, 1))
+        v.send((K.KEY_Q, 0))
+        assert v.output.keys() == []
+
+    run_virtual(config, [K.KEY_Q, K.KEY_LEFTCTRL], body)
+
+
+def test_reload(run_virtual):
+    config = "EVENTS=[KEY_B, KEY_C, KEY_X]\nKEYMAP={KEY_A: KEY_B, KEY_X: KEY_X}\n"
+
+    def body(v):
+        v.send((K.KEY_A, 1))
+        v.send((K.KEY_X, 1))
+        assert v.output.keys() == [[(K.KEY_B, 1)], [(K.KEY_X, 1)]]
+        v.write(config.replace("KEY_A: KEY_B", "KEY_A: KEY_C"))
+        sleep(0.2)
+        # the next frame picks up the new table, and the key pressed under
+        # the old one is let go; X maps the same and stays down
+        v.send((K.KEY_Y, 1))
+        assert v.output.keys() == [[(K.KEY_B, 0)]]
+        v.send((K.KEY_A, 0))
+        v.send((K.KEY_A, 1))
+        v.send((K.KEY_A, 0))
+        assert v.output.keys()[-2:] == [[(K.KEY_C, 1)], [(K.KEY_C, 0)]]
+        v.send((K.KEY_X, 0))
+        assert v.output.keys() == [[(K.KEY_X, 0)]]
+
+        # the output devices cannot change without a restart
+        v.write("EVENTS=[KEY_D]\nKEYMAP={KEY_A: KEY_D}\n")
+        sleep(0.2)
+        v.send((K.KEY_Y, 0))
+        v.send((K.KEY_A, 1))
+        v.send((K.KEY_A, 0))
+        assert v.output.keys() == [[(K.KEY_C, 1)], [(K.KEY_C, 0)]]
+
+    run_virtual(config, [K.KEY_A, K.KEY_X, K.KEY_Y], body)
+
+
+def test_reload_layers(run_virtual):
+    config = ("EVENTS=[KEY_H, KEY_LEFT, KEY_J]\nKEYMAP={KEY_H: KEY_H, KEY_CAPSLOCK: 'nav'}\n"
+              "LAYERS={'nav': {KEY_H: KEY_LEFT}}\n")
+
+    def body(v):
+        v.send((K.KEY_CAPSLOCK, 1))
+        v.send((K.KEY_H, 1))
+        assert v.output.keys() == [[(K.KEY_LEFT, 1)]]
+        # H is a plain remap now, its release would not reach the layer
+        # machine that pressed LEFT
+        v.write("EVENTS=[KEY_H, KEY_LEFT, KEY_J]\nKEYMAP={KEY_H: KEY_J}\n")
+        sleep(0.2)
+        v.send((K.KEY_Y, 1))
+        assert v.output.keys() == [[(K.KEY_LEFT, 0)]]
+        v.send((K.KEY_H, 0))
+        v.send((K.KEY_H, 1))
+        v.send((K.KEY_H, 0))
+        assert v.output.keys()[-2:] == [[(K.KEY_J, 1)], [(K.KEY_J, 0)]]
+
+    run_virtual(config, [K.KEY_H, K.KEY_CAPSLOCK, K.KEY_Y], body)
+
+
+def test_control(run_virtual):
+    config = "EVENTS=[KEY_B]\nKEYMAP={KEY_A: KEY_B}\n"
+
+    def body(v):
+        state = request(v.control, 'state', timeout=1)
+        assert state['outputs'] == [NAME]
+        assert state['sources'] == [v.source.dev]
+        assert not state['paused']
+
+        v.send((K.KEY_A, 1))
+        assert v.output.keys() == [[(K.KEY_B, 1)]]
+        assert request(v.control, 'pause', timeout=1) == {'ok': True}
+        assert request(v.control, 'state', timeout=1)['paused']
+        assert v.source.node.grabbed is None
+        # nothing will release what the pipeline pressed
+        assert v.output.keys() == [[(K.KEY_B, 0)]]
+        v.send((K.KEY_A, 0))
+        assert v.output.keys() == []
+
+        assert request(v.control, 'resume', timeout=1) == {'ok': True}
+        assert v.source.node.grabbed is not None
+        v.send((K.KEY_A, 1))
+        v.send((K.KEY_A, 0))
+        assert v.output.keys() == [[(K.KEY_B, 1)], [(K.KEY_B, 0)]]
+
+        stats = request(v.control, 'stats', timeout=1)
+        # three frames and the release on pause
+        assert stats['sink']['pushed'] == 4
+        assert 'error' in request(v.control, 'bogus', timeout=1)
+        assert request(v.control, timeout=1) == {'error': 'empty command'}
+
+    run_virtual(config, [K.KEY_A], body, control=True)
+
+
+def test_quit_drains(run_virtual):
+    config = "EVENTS=[KEY_B]\nKEYMAP={KEY_A: KEY_B}\n"
+    frames = 1000
+
+    def body(v):
+        for i in range(frames):
+            v.send((K.KEY_A, 1 - i % 2))
+        v.send((K.KEY_ESC, 1))
+        # everything queued is out before the output goes away
+        wait_for(lambda: node(NAME) is None)
+        assert v.output.keys() == [[(K.KEY_B, 1 - i % 2)] for i in range(frames)]
+
+    run_virtual(config, [K.KEY_A], body)
+    # and nothing is left to interrupt anyone later
+    sleep(0.3)
+
+
+def test_emitter_failure(run_virtual, monkeypatch):
+    config = "EVENTS=[KEY_B]\nKEYMAP={KEY_A: KEY_B}\n"
+
+    def emit(self, items, stamp=None):
+        raise OSError("broken output")
+
+    # the interrupt ends main, not the ESC sent once body returns
+    def body(v):
+        v.send((K.KEY_A, 1))
+        sleep(0.3)
+
+    monkeypatch.setattr(virtual.Direct, 'emit', emit)
+    with pytest.raises(KeyboardInterrupt):
+        run_virtual(config, [K.KEY_A], body)
+    sleep(0.3)
+
+
+def test_reload_axes(run_virtual):
+    config = "EVENTS=[KEY_A]\nKEYMAP={KEY_A: KEY_A, ABS.X: ABS.X}\nAXES={ABS.X: dict(range=(0, 1023))}\n"
+    abs = [(ABS.X, input_absinfo(0, 0, 1023, 0, 0, 0))]
+
+    def move(v, value):
+        v.source.write([(EV.ABS, ABS.X, value), (EV.SYN, SYN.REPORT, 0)])
+        return v.output.frames()
+
+    def body(v):
+        assert v.output.dev.get_abs(ABS.X).maximum == 1023
+        assert move(v, 1023) == [[(EV.ABS, ABS.X, 1023)]]
+
+        # the output axis was created with the old range
+        v.write(config.replace("(0, 1023)", "(-32768, 32767)"))
+        sleep(0.2)
+        move(v, 0)
+        assert move(v, 1000) == [[(EV.ABS, ABS.X, 1000)]]
+
+        # same range, taken from the next frame on
+        v.write(config.replace("range=(0, 1023)", "range=(0, 1023), invert=True"))
+        sleep(0.2)
+        move(v, 0)
+        assert move(v, 1023) == [[(EV.ABS, ABS.X, 0)]]
+
+    run_virtual(config, [K.KEY_A], body, abs=abs)
+
+
+def test_outputs(run_virtual):
+    config = ("EVENTS=[KEY_A, KEY_B]\nOUTPUTS={'other': dict(NAME='inputct other', EVENTS=[KEY_C])}\n"
+              "MODIFIERS=[KEY_LEFTCTRL]\nKEYMAP={KEY_A: KEY_A, KEY_C: ('other', KEY_C)}\n"
+              "COMBO={(KEY_LEFTCTRL,): {KEY_D: [(KEY_B, 1), (SYN.REPORT, 0), (KEY_B, 0), (SYN.REPORT, 0)]}}\n")
+
+    def body(v):
+        other = Reader(node('inputct other'))
+        try:
+            v.send((K.KEY_A, 1), (K.KEY_C, 1))
+            v.send((K.KEY_A, 0), (K.KEY_C, 0))
+            assert v.output.keys() == [[(K.KEY_A, 1)], [(K.KEY_A, 0)]]
+            assert other.keys() == [[(K.KEY_C, 1)], [(K.KEY_C, 0)]]
+
+            # one macro step, still two frames
+            v.send((K.KEY_LEFTCTRL, 1))
+            v.send((K.KEY_D, 1))
+            assert v.output.keys() == [[(K.KEY_B, 1)], [(K.KEY_B, 0)]]
+            assert other.keys() == []
+        finally:
+            other.close()
+
+    run_virtual(config, [K.KEY_A, K.KEY_C, K.KEY_D, K.KEY_LEFTCTRL], body)